@@ -0,0 +1,81 @@
+#This file has a pipeline for building lots of ROMs out of the same base ROM, spread over several processes.
+#The base ROM is only loaded once, and each ROM is built on a fork() of it, so none of the workers has to
+# read the base from disk or copy all of it.
+
+import multiprocessing
+import os
+import time
+import traceback
+
+from rom import RomHandler
+
+#the base ROM, as seen from inside each worker process
+_base_rom = None
+
+
+def build_batch(base_filename, build_function, seeds, output_filename_pattern, processes=None,
+                overwrite=False, fix_checksum=True, mmap_mode=None):
+    #for each seed, calls build_function(rom, seed) on a fork of the base ROM, and then saves that ROM to
+    # output_filename_pattern.format(seed=seed)
+    #build_function has to be defined at the top level of a module, so that it can be sent to the worker processes.
+    #processes is the number of worker processes (defaults to the number of cores).  With processes=1, everything
+    # runs in this process, which is handy for debugging.
+    #
+    #returns one dictionary per seed, in the same order as seeds, e.g.
+    #  {"seed": 12, "filename": "out/12.sfc", "seconds": 0.031, "error": None}
+    #where error is the formatted traceback if that build failed.  One failed build does not stop the others.
+    global _base_rom
+
+    seeds = list(seeds)
+    jobs = [(build_function, seed, output_filename_pattern.format(seed=seed), overwrite, fix_checksum) for seed in seeds]
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(jobs)))
+
+    if processes == 1 or "fork" in multiprocessing.get_all_start_methods():
+        #load the base here.  Forked workers inherit it, including the snapshot that its forks are mapped from,
+        # so all of the processes end up sharing the same pages of the base ROM.
+        _base_rom = RomHandler(base_filename, mmap_mode=mmap_mode)
+        _base_rom._get_checksum()       #so that the forks do not each have to sum up the whole base
+        _base_rom.fork().close()        #makes the shared snapshot before any workers exist
+        try:
+            if processes == 1:
+                return [_build_one(job) for job in jobs]
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                return pool.map(_build_one, jobs, chunksize=1)
+        finally:
+            _base_rom.close()
+            _base_rom = None
+    else:
+        #no fork() on this platform, so each worker has to load the base itself (but still only once)
+        with multiprocessing.Pool(processes, initializer=_load_base_rom, initargs=(base_filename, mmap_mode)) as pool:
+            return pool.map(_build_one, jobs, chunksize=1)
+
+
+def _load_base_rom(base_filename, mmap_mode):
+    global _base_rom
+    _base_rom = RomHandler(base_filename, mmap_mode=mmap_mode)
+    _base_rom._get_checksum()
+
+
+def _build_one(job):
+    build_function, seed, filename, overwrite, fix_checksum = job
+    start_time = time.perf_counter()
+    error = None
+    rom = _base_rom.fork()
+    try:
+        build_function(rom, seed)
+        rom.save(filename, overwrite=overwrite, fix_checksum=fix_checksum)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        rom.close()
+    return {"seed": seed, "filename": filename, "seconds": time.perf_counter() - start_time, "error": error}
+
+
+def main():
+    print(f"Called main() on utility library {__file__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#This file times the paths through RomHandler and util that everything else leans on, using synthetic ROMs that it
+# builds for itself (so no real ROMs are needed, and every run sees exactly the same data).
+#
+#  python benchmark.py --output results.json                      #run everything and save the results
+#  python benchmark.py --baseline results.json                    #run everything and compare against earlier results
+#  python benchmark.py --filter checksum --baseline results.json  #only the benchmarks with "checksum" in their name
+#
+#when comparing, the exit code is 1 if anything got slower than the baseline by more than --threshold.  The fastest
+# sample of each benchmark is compared, since that is the one least disturbed by whatever else the machine is doing,
+# and anything that looks slower is run again (up to --retries times) to make sure that it was not just a noisy moment.
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import util
+from rom import RomHandler, RomType, _INTERNAL_HEADER_ADDRESSES
+
+_MAKEUP_BYTES = {RomType.LOROM: 0x20, RomType.HIROM: 0x21, RomType.EXLOROM: 0x32, RomType.EXHIROM: 0x35}
+
+#the ROM that each type is benchmarked with (in MBits)
+_ROM_SIZES = {RomType.LOROM: 16, RomType.HIROM: 32, RomType.EXLOROM: 48, RomType.EXHIROM: 64}
+
+
+def build_synthetic_rom(filename, rom_type, mbits, headered=False, seed=0):
+    #writes a ROM full of random bytes (from seed), with a valid internal header and checksum, that RomHandler will
+    # recognize as rom_type
+    data = bytearray(np.random.RandomState(seed).randint(0, 256, mbits*0x20000, dtype=np.uint8).tobytes())
+    header_address = _INTERNAL_HEADER_ADDRESSES[rom_type]
+    data[header_address:header_address+21] = b"BENCHMARK ROM".ljust(21)
+    data[header_address+0x15] = _MAKEUP_BYTES[rom_type]
+    data[header_address+0x17] = 0x07 + (mbits-1).bit_length()
+    data[header_address+0x1C:header_address+0x20] = bytes([0xFF, 0xFF, 0x00, 0x00])   #complement and checksum that agree
+    with open(filename, "wb") as file:
+        if headered:
+            file.write(bytes(0x200))
+        file.write(data)
+
+    #now let RomHandler work out the real checksum
+    rom = RomHandler(filename)
+    rom.save(filename, overwrite=True)
+    return filename
+
+
+class _Benchmark:
+    #op(state) is what gets timed.  setup() makes the state: if per_call_setup is set, it is called again before every
+    # call (outside of the timing), otherwise it is called once and the same state is used for every call
+    def __init__(self, name, setup, op, per_call_setup=False):
+        self.name = name
+        self.setup = setup
+        self.op = op
+        self.per_call_setup = per_call_setup
+
+    def run(self, repeats, min_sample_seconds):
+        samples = []
+        if self.per_call_setup:
+            for _ in range(repeats):
+                state = self.setup()
+                start_time = time.perf_counter()
+                self.op(state)
+                samples.append(time.perf_counter() - start_time)
+            calls = 1
+        else:
+            state = self.setup()
+            calls = self._calibrate(state, min_sample_seconds)
+            for _ in range(repeats):
+                samples.append(self._time_calls(state, calls) / calls)
+        return {"seconds_per_call": statistics.median(samples), "min_seconds_per_call": min(samples),
+                "calls_per_sample": calls, "samples": len(samples)}
+
+    def _calibrate(self, state, min_sample_seconds):
+        #keep doubling the number of calls until one sample takes long enough to be timed reliably
+        calls = 1
+        while True:
+            if self._time_calls(state, calls) >= min_sample_seconds or calls >= 1 << 20:
+                return calls
+            calls *= 2
+
+    def _time_calls(self, state, calls):
+        op = self.op
+        start_time = time.perf_counter()
+        for _ in range(calls):
+            op(state)
+        return time.perf_counter() - start_time
+
+
+def _get_benchmarks(directory):
+    benchmarks = []
+    roms = {}
+    for rom_type, mbits in _ROM_SIZES.items():
+        filename = os.path.join(directory, f"{rom_type.name.lower()}.sfc")
+        roms[rom_type] = RomHandler(build_synthetic_rom(filename, rom_type, mbits, headered=(rom_type == RomType.HIROM)))
+    lorom = roms[RomType.LOROM]
+
+    #reading and writing
+    for encoding in [1, 2, 3, 4, "1", "2", "3", "4", "1212", "33", "2"*16, "1"*21]:
+        num_values = len(encoding) if type(encoding) is str else 1
+        values = [0x12]*num_values if type(encoding) is str else 0x12
+        label = encoding if type(encoding) is int else f"'{encoding}'"
+        benchmarks.append(_Benchmark(f"read[{label}]", lambda: lorom, lambda rom, encoding=encoding: rom.read(0x8123, encoding)))
+        benchmarks.append(_Benchmark(f"write[{label}]", lambda: lorom,
+                                     lambda rom, encoding=encoding, values=values: rom.write(0x8123, values, encoding)))
+    benchmarks.append(_Benchmark("read_many['22'x256]", lambda: lorom, lambda rom: rom.read_many(0x8000, "22", 256)))
+    benchmarks.append(_Benchmark("bulk_read[0x8000]", lambda: lorom, lambda rom: rom.bulk_read(0x8000, 0x8000)))
+    benchmarks.append(_Benchmark("read_from_snes_address[2]", lambda: lorom, lambda rom: rom.read_from_snes_address(0x81A123, 2)))
+
+    #address translation, for every type
+    for rom_type, rom in roms.items():
+        name = rom_type.name.lower()
+        pc_address = rom._rom_size - 0x1235
+        snes_address = rom.convert_to_snes_address(pc_address)
+        benchmarks.append(_Benchmark(f"convert_to_pc_address[{name}]", lambda rom=rom: rom,
+                                     lambda rom, snes_address=snes_address: rom.convert_to_pc_address(snes_address)))
+        benchmarks.append(_Benchmark(f"convert_to_snes_address[{name}]", lambda rom=rom: rom,
+                                     lambda rom, pc_address=pc_address: rom.convert_to_snes_address(pc_address)))
+
+    #checksums, at power of 2 sizes and at the odd ones (which have to count part of the ROM more than once)
+    for mbits in [8, 12, 16, 20, 24, 28, 32, 48]:
+        rom_type = RomType.EXHIROM if mbits > 32 else RomType.HIROM
+        filename = build_synthetic_rom(os.path.join(directory, f"checksum{mbits}.sfc"), rom_type, mbits, seed=mbits)
+        benchmarks.append(_Benchmark(f"checksum_full[{mbits}mbit]", lambda filename=filename: RomHandler(filename),
+                                     lambda rom: rom._get_checksum(full_recompute=True)))
+        benchmarks.append(_Benchmark(f"checksum_after_write[{mbits}mbit]", lambda filename=filename: _loaded_with_checksum(filename),
+                                     lambda rom: (rom.write(0x12345, 0x56, 1), rom._get_checksum())))
+
+    #expanding and saving
+    small_filename = build_synthetic_rom(os.path.join(directory, "small.sfc"), RomType.LOROM, 8, seed=8)
+    small_rom = RomHandler(small_filename)
+    benchmarks.append(_Benchmark("expand[8->32mbit]", lambda: small_rom.fork(), lambda rom: rom.expand(32), per_call_setup=True))
+    save_filename = os.path.join(directory, "saved.sfc")
+    benchmarks.append(_Benchmark("save[16mbit]", lambda: lorom, lambda rom: rom.save(save_filename, overwrite=True)))
+    benchmarks.append(_Benchmark("save_atomic[16mbit]", lambda: lorom,
+                                 lambda rom: rom.save(save_filename, overwrite=True, atomic=True)))
+    benchmarks.append(_Benchmark("save_in_place[16mbit]", lambda: _saved_to(lorom, save_filename),
+                                 lambda rom: rom.save(save_filename, in_place=True)))
+
+    #graphics
+    random_state = np.random.RandomState(1)
+    for bpp in [2, 4, 8]:
+        raw_sheet = random_state.randint(0, 256, 8*bpp*1024, dtype=np.uint8).tobytes()
+        indexed_sheet = util.convert_tiles_from_bitplanes(raw_sheet, bpp)
+        benchmarks.append(_Benchmark(f"decode_tiles[1024x{bpp}bpp]", lambda raw_sheet=raw_sheet: raw_sheet,
+                                     lambda raw_sheet, bpp=bpp: util.convert_tiles_from_bitplanes(raw_sheet, bpp)))
+        benchmarks.append(_Benchmark(f"encode_tiles[1024x{bpp}bpp]", lambda indexed_sheet=indexed_sheet: indexed_sheet,
+                                     lambda indexed_sheet, bpp=bpp: util.convert_indexed_tiles_to_bitplanes(indexed_sheet, bpp)))
+    raw_tile = list(random_state.randint(0, 256, 32))
+    benchmarks.append(_Benchmark("decode_tile[single]", lambda: raw_tile, util.convert_tile_from_bitplanes))
+
+    tilemaps = [[int(random_state.randint(0, 256)), 0xC2 if i % 2 else 0x00, int(random_state.randint(0, 256)),
+                 int(random_state.randint(0, 0x6E)), int(random_state.randint(0, 256))] for i in range(32)]
+    DMA_writes = {index: list(random_state.randint(0, 256, 32)) for index in range(0x80)}
+    benchmarks.append(_Benchmark("image_from_raw_data[32 tilemaps, cached]", lambda: (tilemaps, DMA_writes),
+                                 lambda frame: util.image_from_raw_data(*frame)))
+    benchmarks.append(_Benchmark("image_from_raw_data[32 tilemaps, uncached]", lambda: (tilemaps, DMA_writes),
+                                 lambda frame: util.render_frame(*frame, cache=None)))
+    return benchmarks
+
+
+def _loaded_with_checksum(filename):
+    rom = RomHandler(filename)
+    rom._get_checksum()
+    return rom
+
+
+def _saved_to(rom, filename):
+    rom.save(filename, overwrite=True)
+    return rom
+
+
+def run_benchmarks(name_filter=None, repeats=5, min_sample_seconds=0.02, names=None):
+    #runs every benchmark (whose name contains name_filter, if given, and which is in names, if given) and returns the
+    # results, ready for json
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for benchmark in _get_benchmarks(directory):
+            if (name_filter is None or name_filter in benchmark.name) and (names is None or benchmark.name in names):
+                results[benchmark.name] = benchmark.run(repeats, min_sample_seconds)
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline, threshold=0.25):
+    #returns a list of (name, baseline seconds, current seconds, ratio, status) for every benchmark in both,
+    # where status is "slower" or "faster" if the ratio is more than threshold away from 1, and "same" otherwise.
+    #the seconds are those of the fastest sample, since the median of a handful of samples moves around too much
+    comparisons = []
+    for name, result in results["results"].items():
+        baseline_result = baseline["results"].get(name)
+        if baseline_result is None:
+            continue
+        old_seconds = baseline_result.get("min_seconds_per_call", baseline_result["seconds_per_call"])
+        new_seconds = result["min_seconds_per_call"]
+        ratio = new_seconds / old_seconds if old_seconds > 0 else float("inf")
+        if ratio > 1 + threshold:
+            status = "slower"
+        elif ratio < 1 / (1 + threshold):
+            status = "faster"
+        else:
+            status = "same"
+        comparisons.append((name, old_seconds, new_seconds, ratio, status))
+    return comparisons
+
+
+def _confirm_slowdowns(results, baseline, threshold, retries, repeats):
+    #runs whatever compare() says is slower again, keeping the faster of the results for each, until either nothing is
+    # slower any more or it has been tried retries times.  Returns the final comparisons.
+    #each retry is in a new interpreter, since the smallest benchmarks can be quite a bit faster or slower in one
+    # process than in another (e.g. from where things happen to land in memory), and that would not change within one
+    comparisons = compare(results, baseline, threshold)
+    for _ in range(retries):
+        slower = {name for name, *_, status in comparisons if status == "slower"}
+        if not slower:
+            break
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            retry_results = pool.apply(run_benchmarks, (None, repeats), {"names": slower})
+        for name, result in retry_results["results"].items():
+            if result["min_seconds_per_call"] < results["results"][name]["min_seconds_per_call"]:
+                results["results"][name] = result
+        comparisons = compare(results, baseline, threshold)
+    return comparisons
+
+
+def _format_seconds(seconds):
+    for unit, scale in [("s", 1), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= scale:
+            return f"{seconds/scale:.3g}{unit}"
+    return f"{seconds/1e-9:.3g}ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for RomHandler and util")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeats", type=int, default=5, help="samples per benchmark (the median is reported, and the fastest is compared)")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative change that counts as slower/faster")
+    parser.add_argument("--retries", type=int, default=2, help="how many times to run again anything that looks slower")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.filter, args.repeats)
+    comparisons = None
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        comparisons = _confirm_slowdowns(results, baseline, args.threshold, args.retries, args.repeats)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if comparisons is not None:
+        for name, old_seconds, new_seconds, ratio, status in comparisons:
+            print(f"{name:50} {_format_seconds(old_seconds):>10} -> {_format_seconds(new_seconds):>10}  x{ratio:.2f}  {status}")
+        if any(status == "slower" for *_, status in comparisons):
+            sys.exit(1)
+    else:
+        for name, result in results["results"].items():
+            print(f"{name:50} {_format_seconds(result['seconds_per_call']):>10}")
+
+
+if __name__ == "__main__":
+    main()
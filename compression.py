@@ -0,0 +1,292 @@
+#This file has decompressors and compressors for the LZ formats that most SNES games use for their graphics
+# (named after the Lunar Compress formats they match: LC_LZ2 and LC_LZ3).
+#
+#Both formats are a series of commands.  Each command starts with a header byte CCCLLLLL, where CCC is the command and
+# LLLLL is the length minus one.  If CCC is 111, the header is two bytes long instead: 111CCCLL LLLLLLLL, which allows
+# lengths up to 1024.  A header byte of $FF ends the data.
+#
+#  command  LC_LZ2                                  LC_LZ3
+#  0        copy the next L bytes                   (same)
+#  1        repeat the next byte L times            (same)
+#  2        alternate the next 2 bytes for L bytes  (same)
+#  3        count up from the next byte, L times    write L zeros
+#  4        copy L bytes from earlier in the output (same, but see below)
+#  5                                                as 4, but with each byte bit-reversed
+#  6                                                as 4, but reading backwards
+#
+#in LC_LZ2, the copy commands are followed by the 2 byte position to copy from, which is big endian in most games
+# but little endian in some (e.g. A Link to the Past).  In LC_LZ3, that position is either two big endian bytes
+# (if the first byte is less than $80), or a single byte $80+N, which means N+1 bytes before the current position.
+#
+#everything here works on any bytes-like object (bytes, bytearray, memoryview, numpy arrays of bytes), and the
+# decompressors can write into a buffer that already exists, e.g. one that the tile decoder is going to read:
+#  raw_tiles, end = decompress_lz2(rom.view(pc_address, 0x8000), output=buffer)
+#  tiles = util.convert_tiles_from_bitplanes(raw_tiles)
+
+_END_OF_DATA = 0xFF
+_LONG_COMMAND = 7
+_MAX_SHORT_LENGTH = 0x20
+_MAX_LENGTH = 0x400
+
+#every byte with its bits in reverse order, for LC_LZ3 command 5
+_BIT_REVERSED = bytes(int(f"{byte:08b}"[::-1], 2) for byte in range(0x100))
+#0, 1, ..., 255, 0, 1, ... so that any run of counting bytes is just a slice of this
+_COUNTING_BYTES = bytes(range(0x100)) * (_MAX_LENGTH//0x100 + 1)
+
+#how many earlier positions the compressors look at for each match (more compresses better, but slower)
+_MATCH_CANDIDATES = 32
+
+
+def decompress_lz2(data, offset=0, output=None, big_endian_offsets=True):
+    #decompresses LC_LZ2 data that starts at data[offset].
+    #the result is written into output, which can be anything writable and bytes-like that is big enough (a bytearray will
+    # grow if it needs to).  If there is no output, a bytearray is made.
+    #returns (a memoryview of the decompressed part of output, the offset just past the end of the compressed data)
+    return _decompress(data, offset, output, _decode_lz2_command, big_endian_offsets)
+
+
+def decompress_lz3(data, offset=0, output=None):
+    #same as decompress_lz2(), but for LC_LZ3
+    return _decompress(data, offset, output, _decode_lz3_command, True)
+
+
+def compress_lz2(data, big_endian_offsets=True):
+    #the inverse of decompress_lz2(): returns the compressed data as bytes.  Copies can only come from the first 64KB
+    return _compress(bytes(data), lz3=False, big_endian_offsets=big_endian_offsets)
+
+
+def compress_lz3(data):
+    #the inverse of decompress_lz3(): returns the compressed data as bytes.  Copies can only come from the first 32KB, or
+    # from the 128 bytes just before.  Only the forward copy is used (never the bit-reversed or backwards ones).
+    return _compress(bytes(data), lz3=True, big_endian_offsets=True)
+
+
+def _decompress(data, offset, output, decode_command, big_endian_offsets):
+    source = memoryview(data).cast("B") if not isinstance(data, (bytes, bytearray)) else data
+    if output is None:
+        output = bytearray(0x10000)
+    growable = isinstance(output, bytearray)
+    output_view = memoryview(output).cast("B")
+    position = 0
+
+    while True:
+        if offset >= len(source):
+            raise AssertionError("LZ data ends without an end of data marker")
+        header = source[offset]
+        if header == _END_OF_DATA:
+            return output_view[:position], offset + 1
+        command, length = header >> 5, (header & 0x1F) + 1
+        offset += 1
+        if command == _LONG_COMMAND:
+            command, length = (header >> 2) & 0x07, (((header & 0x03) << 8) | source[offset]) + 1
+            offset += 1
+
+        if position + length > len(output_view):
+            if not growable:
+                raise AssertionError(f"LZ data decompresses to more than the {hex(len(output_view))} bytes of the output buffer")
+            output_view.release()
+            output.extend(bytes(max(len(output), position + length - len(output))))
+            output_view = memoryview(output)
+
+        try:
+            chunk, offset = decode_command(source, offset, command, length, output_view, position, big_endian_offsets)
+        except IndexError:
+            raise AssertionError("LZ data ends in the middle of a command") from None
+        if len(chunk) != length:
+            raise AssertionError("LZ data ends in the middle of a command")
+        output_view[position:position+length] = chunk
+        position += length
+
+
+def _decode_lz2_command(source, offset, command, length, output, position, big_endian_offsets):
+    #returns the bytes that the command writes, and where the next command starts
+    if command == 0:
+        return source[offset:offset+length], offset + length
+    elif command == 1:
+        return bytes((source[offset],)) * length, offset + 1
+    elif command == 2:
+        return _alternate(source[offset], source[offset+1], length), offset + 2
+    elif command == 3:
+        start = source[offset]
+        return _COUNTING_BYTES[start:start+length], offset + 1
+    elif command == 4:
+        if big_endian_offsets:
+            copy_from = (source[offset] << 8) | source[offset+1]
+        else:
+            copy_from = source[offset] | (source[offset+1] << 8)
+        return _copy_forwards(output, copy_from, position, length), offset + 2
+    else:
+        raise AssertionError(f"LC_LZ2 data has an unknown command {command} at {hex(offset)}")
+
+
+def _decode_lz3_command(source, offset, command, length, output, position, big_endian_offsets):
+    if command == 0:
+        return source[offset:offset+length], offset + length
+    elif command == 1:
+        return bytes((source[offset],)) * length, offset + 1
+    elif command == 2:
+        return _alternate(source[offset], source[offset+1], length), offset + 2
+    elif command == 3:
+        return bytes(length), offset
+    elif command in [4, 5, 6]:
+        if source[offset] & 0x80:
+            copy_from = position - (source[offset] & 0x7F) - 1
+            offset += 1
+        else:
+            copy_from = (source[offset] << 8) | source[offset+1]
+            offset += 2
+        if command == 4:
+            return _copy_forwards(output, copy_from, position, length), offset
+        elif command == 5:
+            return _copy_bit_reversed(output, copy_from, position, length), offset
+        else:
+            if copy_from >= position or copy_from - length + 1 < 0:
+                raise AssertionError(f"LC_LZ3 data copies backwards from {hex(copy_from)}, past the start of what has been written")
+            return bytes(output[copy_from-length+1:copy_from+1])[::-1], offset
+    else:
+        raise AssertionError(f"LC_LZ3 data has an unknown command {command} at {hex(offset)}")
+
+
+def _alternate(first_byte, second_byte, length):
+    return (bytes((first_byte, second_byte)) * ((length+1)//2))[:length]
+
+
+def _copy_forwards(output, copy_from, position, length):
+    #what copying length bytes, one at a time, from copy_from to position would write
+    if copy_from < 0 or copy_from >= position:
+        raise AssertionError(f"LZ data copies from {hex(copy_from)}, which has not been written yet (at {hex(position)})")
+    if copy_from + length <= position:
+        return bytes(output[copy_from:copy_from+length])
+    #the copy overlaps what it writes, so it repeats the bytes between copy_from and position
+    period = bytes(output[copy_from:position])
+    return (period * (length//len(period) + 1))[:length]
+
+
+def _copy_bit_reversed(output, copy_from, position, length):
+    #what copying length bytes, one at a time, from copy_from to position and bit-reversing each one would write
+    if copy_from < 0 or copy_from >= position:
+        raise AssertionError(f"LZ data copies from {hex(copy_from)}, which has not been written yet (at {hex(position)})")
+    reversed_bytes = bytes(output[copy_from:min(position, copy_from+length)]).translate(_BIT_REVERSED)
+    if copy_from + length <= position:
+        return reversed_bytes
+    #the copy overlaps what it writes, so it comes back around to bytes that it has reversed already and reverses them
+    # back again.  So it alternates between the bytes between copy_from and position, reversed and then as they were
+    period = bytes(output[copy_from:position])
+    return ((reversed_bytes + period) * (length//(2*len(period)) + 1))[:length]
+
+
+def _compress(data, lz3, big_endian_offsets):
+    #greedy: at each position, take whichever command covers the most bytes for what it costs, or else save the byte
+    # up to be copied as-is.  Earlier positions are found through chains of where each 3 byte sequence was seen.
+    compressed = bytearray()
+    literal_start = 0
+    position = 0
+    recent_positions = {}       #3 byte sequence -> positions where it starts, most recent last
+    size = len(data)
+
+    while position < size:
+        limit = min(_MAX_LENGTH, size - position)
+        best_length, best_cost, best_command = 0, 0, None
+
+        #fills
+        fill_length = 1 + _common_prefix_length(data, position, position+1, limit-1)
+        if lz3 and data[position] == 0:
+            best_length, best_cost, best_command = fill_length, 0, (3, b"")
+        else:
+            best_length, best_cost, best_command = fill_length, 1, (1, data[position:position+1])
+        if limit >= 2:
+            word_length = 2 + _common_prefix_length(data, position, position+2, limit-2)
+            if word_length - 2 > best_length - best_cost:
+                best_length, best_cost, best_command = word_length, 2, (2, data[position:position+2])
+        if not lz3:
+            start = data[position]
+            count_length = _common_prefix_length_with(data, position, _COUNTING_BYTES, start, limit)
+            if count_length - 1 > best_length - best_cost:
+                best_length, best_cost, best_command = count_length, 1, (3, data[position:position+1])
+
+        #copies from earlier in the data
+        if limit >= 3:
+            key = data[position:position+3]
+            for candidate in reversed(recent_positions.get(key, ())[-_MATCH_CANDIDATES:]):
+                relative = lz3 and position - candidate <= 0x80
+                if not relative and candidate >= (0x8000 if lz3 else 0x10000):
+                    continue
+                match_length = 3 + _common_prefix_length(data, candidate+3, position+3, limit-3)
+                cost = 1 if relative else 2
+                if match_length - cost > best_length - best_cost:
+                    if relative:
+                        argument = bytes((0x80 | (position - candidate - 1),))
+                    elif big_endian_offsets:
+                        argument = candidate.to_bytes(2, "big")
+                    else:
+                        argument = candidate.to_bytes(2, "little")
+                    best_length, best_cost, best_command = match_length, cost, (4, argument)
+                    if match_length == limit:
+                        break
+
+        #only worth it if it beats copying the bytes as-is (counting the header that it costs to stop and restart a copy)
+        header_cost = 1 if best_length <= _MAX_SHORT_LENGTH else 2
+        if best_length > best_cost + header_cost + (1 if position > literal_start else 0):
+            _write_literals(compressed, data, literal_start, position)
+            command, argument = best_command
+            _write_header(compressed, command, best_length)
+            compressed += argument
+            next_position = position + best_length
+            literal_start = next_position
+        else:
+            next_position = position + 1
+            if next_position - literal_start == _MAX_LENGTH:
+                _write_literals(compressed, data, literal_start, next_position)
+                literal_start = next_position
+
+        for indexed_position in range(position, min(next_position, size-2)):
+            recent_positions.setdefault(data[indexed_position:indexed_position+3], []).append(indexed_position)
+        position = next_position
+
+    _write_literals(compressed, data, literal_start, size)
+    compressed.append(_END_OF_DATA)
+    return bytes(compressed)
+
+
+def _write_header(compressed, command, length):
+    if length <= _MAX_SHORT_LENGTH:
+        compressed.append((command << 5) | (length - 1))
+    else:
+        compressed.append(0xE0 | (command << 2) | ((length - 1) >> 8))
+        compressed.append((length - 1) & 0xFF)
+
+
+def _write_literals(compressed, data, start, end):
+    if end > start:
+        _write_header(compressed, 0, end - start)
+        compressed += data[start:end]
+
+
+def _common_prefix_length(data, first, second, limit):
+    #how many bytes (up to limit) data[first:] and data[second:] have in common at the start
+    return _common_prefix_length_with(data, first, data, second, limit)
+
+
+def _common_prefix_length_with(data, position, other, other_position, limit):
+    #the same, for data[position:] and other[other_position:]
+    limit = max(0, min(limit, len(data) - position, len(other) - other_position))
+    #gallop up to a length that does not match, and then narrow it down, comparing whole slices at a time
+    low, high = 0, 1
+    while high <= limit and data[position:position+high] == other[other_position:other_position+high]:
+        low, high = high, high*2
+    high = min(high, limit+1)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if data[position:position+middle] == other[other_position:other_position+middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def main():
+    print(f"Called main() on utility library {__file__}")
+
+
+if __name__ == "__main__":
+    main()
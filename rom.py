@@ -8,6 +8,21 @@
 import struct
 import os
 import enum
+import mmap
+import copy
+import tempfile
+import zlib
+import zipfile
+import gzip
+import bz2
+import lzma
+import io
+import time
+import json
+import collections
+import bisect
+import weakref
+import numpy as np
 
 #enumeration for the rom types
 class RomType(enum.Enum):
@@ -17,77 +32,655 @@ class RomType(enum.Enum):
     EXLOROM = 0b010
     EXHIROM = 0b101
 
+#encodings are compiled into these plans the first time they are used, and then reused from here
+_ENCODING_PLANS = {}
+
+def _get_encoding_plan(encoding, stride=None):
+    #returns the compiled plan for an encoding string (or integer size), optionally padded out to stride bytes
+    key = (encoding, stride)
+    plan = _ENCODING_PLANS.get(key)
+    if plan is None:
+        plan = _EncodingPlan(encoding, stride)
+        _ENCODING_PLANS[key] = plan
+    return plan
+
+class _EncodingPlan:
+    #the struct codes for each size.  There is no native 3-byte code, so those are unpacked as a word and a byte
+    _STRUCT_CODES = {"1": "B", "2": "H", "3": "HB", "4": "L"}
+
+    def __init__(self, encoding, stride=None):
+        if type(encoding) is int:
+            if encoding < 1 or encoding > 4:
+                raise NotImplementedError(f"Encoding of size {encoding} is not implemented.")
+            encoding = str(encoding)
+
+        struct_code = "<"     #the '<' forces it to read as little-endian
+        self._long_fields = []      #where each 3-byte value starts, in the raw unpacked tuple
+        self._long_values = []      #where each 3-byte value is, in the list of values
+        raw_position = 0
+        for position,code in enumerate(encoding):
+            if code not in self._STRUCT_CODES:
+                raise NotImplementedError(f"Encoding {encoding} asks for size {code}, but this is not implemented.")
+            if code == "3":
+                self._long_fields.append(raw_position)
+                self._long_values.append(position)
+            struct_code += self._STRUCT_CODES[code]
+            raw_position += len(self._STRUCT_CODES[code])
+
+        self.size = struct.calcsize(struct_code)
+        self.length = len(encoding)
+        self.struct = struct.Struct(struct_code)
+
+        #for reading whole tables: skip over any bytes between the end of one record and the start of the next
+        self.stride = self.size if stride is None else stride
+        if self.stride > self.size:
+            self.padded_struct = struct.Struct(struct_code + "x"*(self.stride-self.size))
+        elif self.stride == self.size:
+            self.padded_struct = self.struct
+        else:
+            self.padded_struct = None   #overlapping records, so these will have to be unpacked one at a time
+
+    def merge(self, raw_values):
+        #turns the raw unpacked tuple into a list of values, gluing the 3-byte values back together
+        values = list(raw_values)
+        for i in reversed(self._long_fields):
+            values[i:i+2] = [values[i] | (values[i+1] << 16)]
+        return values
+
+    def split(self, values):
+        #the opposite of merge(): breaks each 3-byte value into a word and a byte for packing
+        if not self._long_values:
+            return values
+        values = list(values)
+        for i in reversed(self._long_values):
+            values[i:i+1] = [values[i] & 0xFFFF, values[i] >> 16]
+        return values
+
+    def unpack_from(self, buffer, offset):
+        if self._long_fields:
+            return self.merge(self.struct.unpack_from(buffer, offset))
+        return list(self.struct.unpack_from(buffer, offset))
+
+    def pack_into(self, buffer, offset, values):
+        self.struct.pack_into(buffer, offset, *self.split(values))
+
+#the address translation tables for each (ROM type, ROM size), see RomHandler._build_bank_maps()
+_BANK_MAPS = {}
+
+#helpers for the IPS/BPS patch formats
+_IPS_EOF_OFFSET = 0x454F46      #the offset that spells "EOF", which cannot be used as the start of an IPS record
+
+def _find_runs(mask, min_gap=0):
+    #returns (starts, ends) of each run of True in a boolean numpy array.
+    #runs that are separated by min_gap or fewer False values are treated as a single run
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    starts, ends = edges[0::2], edges[1::2]
+    if min_gap > 0 and len(starts) > 1:
+        separate = (starts[1:] - ends[:-1]) > min_gap
+        starts = starts[np.concatenate(([True], separate))]
+        ends = ends[np.concatenate((separate, [True]))]
+    return starts.tolist(), ends.tolist()
+
+def _encode_bps_number(number):
+    #BPS uses a variable length encoding where each byte carries 7 bits, and the last byte has its high bit set
+    encoded = bytearray()
+    while True:
+        low_bits = number & 0x7F
+        number >>= 7
+        if number == 0:
+            encoded.append(0x80 | low_bits)
+            return encoded
+        encoded.append(low_bits)
+        number -= 1
+
+def _decode_bps_number(patch, position):
+    #returns the decoded number and the position just after it
+    number = 0
+    shift = 1
+    while True:
+        byte = patch[position]
+        position += 1
+        number += (byte & 0x7F)*shift
+        if byte & 0x80:
+            return number, position
+        shift <<= 7
+        number += shift
+
+_COPIER_HEADER_SIZE = 0x200
+
+#where the internal header sits (as a PC address) for each type of ROM
+_INTERNAL_HEADER_ADDRESSES = {
+    RomType.LOROM:   0x7FC0,
+    RomType.HIROM:   0xFFC0,
+    RomType.EXLOROM: 0x407FC0,
+    RomType.EXHIROM: 0x40FFC0,
+}
+_INTERNAL_HEADER_SIZE = 0x40
+
+def _split_file_size(file_size, header_size, filename):
+    #figure out if it has a header by inferring from the overall file size.  Returns (is headered, ROM size)
+    if file_size % 0x8000 == 0:
+        return False, file_size
+    elif file_size % 0x8000 == header_size:
+        return True, file_size - header_size
+    else:
+        raise AssertionError(f"{filename} does not contain an even number of half banks...is this a valid ROM?")
+
+def _detect_rom_type(rom_size, read_bytes):
+    #Determine the type of ROM (e.g. LoRom or HiRom) by comparing against checksum complement.
+    #only the candidate internal headers are looked at: read_bytes(addr, num_bytes) should return the bytes of the ROM
+    # (not counting any copier header) starting at addr, or fewer of them if the ROM ends first.
+    #returns the type and the internal header that goes with it
+    LOWER_ASCII = 0x20
+    UPPER_ASCII = 0x7E
+    ROM_TITLE_SIZE = 21
+    if rom_size > 32*0x20000: #larger than 32 MBit
+        lo_type, hi_type = RomType.EXLOROM, RomType.EXHIROM
+    else:
+        lo_type, hi_type = RomType.LOROM, RomType.HIROM
+    lo_header = bytes(read_bytes(_INTERNAL_HEADER_ADDRESSES[lo_type], _INTERNAL_HEADER_SIZE))
+    hi_header = bytes(read_bytes(_INTERNAL_HEADER_ADDRESSES[hi_type], _INTERNAL_HEADER_SIZE))
+
+    if _checksum_matches_complement(lo_header):
+        return lo_type, lo_header
+    elif _checksum_matches_complement(hi_header):
+        return hi_type, hi_header
+    else:   #the checksum is bad, so try to infer from the internal header being valid characters or not
+        lorom_char_count = sum(x >= LOWER_ASCII and x <= UPPER_ASCII for x in lo_header[:ROM_TITLE_SIZE])
+        hirom_char_count = sum(x >= LOWER_ASCII and x <= UPPER_ASCII for x in hi_header[:ROM_TITLE_SIZE])
+        if lorom_char_count >= hirom_char_count:
+            return lo_type, lo_header
+        else:
+            return hi_type, hi_header
+
+def _checksum_matches_complement(internal_header):
+    if len(internal_header) < _INTERNAL_HEADER_SIZE:
+        return False
+    complement, checksum = struct.unpack_from("<HH", internal_header, 0x1C)
+    return complement + checksum == 0xFFFF
+
+def _check_makeup_byte(rom_type, makeup_byte):
+    #check to make sure the makeup byte confirms our determination of the ROM type
+    if rom_type == RomType.LOROM and makeup_byte in [0x20,0x30]:
+        pass    #lorom confirmed
+    elif rom_type == RomType.HIROM and makeup_byte in [0x21, 0x31]:
+        pass    #hirom confirmed
+    elif (rom_type == RomType.LOROM or rom_type == RomType.HIROM) and makeup_byte == 0x23:
+        pass    #Maybe SA-1 will work with this library.  MAYBE.
+    elif rom_type == RomType.EXLOROM and makeup_byte == 0x32:
+        pass    #exlorom confirmed
+    elif rom_type == RomType.EXHIROM and makeup_byte == 0x35:
+        pass    #exhirom confirmed
+    else:
+        raise AssertionError(f"Cannot recognize the makeup byte of this ROM: {hex(makeup_byte)}.")
+
+#what ROM files are usually called
+_ROM_EXTENSIONS = (".sfc", ".smc", ".swc", ".fig")
+
+def _read_stream(stream, size=None):
+    #reads a file-like object into a new bytearray: exactly size bytes straight into a buffer of that size if the size
+    # is known, or else everything up to the end of the stream
+    if size is None:
+        contents = bytearray()
+        while True:
+            chunk = stream.read(0x100000)
+            if not chunk:
+                return contents
+            contents += chunk
+
+    contents = bytearray(size)
+    with memoryview(contents) as view:
+        position = 0
+        while position < size:
+            if hasattr(stream, "readinto"):
+                count = stream.readinto(view[position:])
+            else:
+                chunk = stream.read(size - position)
+                count = len(chunk)
+                view[position:position+count] = chunk
+            if not count:
+                raise AssertionError(f"Expected {hex(size)} bytes, but the stream ended after {hex(position)}")
+            position += count
+    return contents
+
+def _is_seekable(stream):
+    return hasattr(stream, "seekable") and stream.seekable()
+
+def _choose_archive_member(archive, member):
+    #which file in a zip to read the ROM from (see RomHandler.from_archive())
+    if member is not None:
+        return archive.getinfo(member)
+    files = [info for info in archive.infolist() if not info.is_dir()]
+    roms = [info for info in files if info.filename.lower().endswith(_ROM_EXTENSIONS)]
+    if len(files) == 1:
+        return files[0]
+    elif len(roms) == 1:
+        return roms[0]
+    raise AssertionError(f"Cannot tell which file in the archive is the ROM, please choose one of: {[info.filename for info in files]}")
+
+def probe(filename):
+    #learns what it can about a ROM from its file size and its internal header, without reading the rest of the file
+    # (or building a RomHandler).  The type is decided exactly as RomHandler decides it, and the same errors are raised.
+    #returns a dictionary like
+    #  {"file_size": 0x100200, "headered": True, "rom_size": 0x100000, "type": RomType.LOROM, "title": "SUPER METROID",
+    #   "makeup_byte": 0x30, "rom_size_code": 0x0C, "checksum": 0x1234, "checksum_complement": 0xEDCB, "checksum_valid": True}
+    #checksum_valid only says that the checksum and its complement agree.  Whether the checksum is right for the
+    # contents cannot be known without summing the whole file.
+    file_size = os.path.getsize(filename)
+    headered, rom_size = _split_file_size(file_size, _COPIER_HEADER_SIZE, filename)
+    content_start = _COPIER_HEADER_SIZE if headered else 0
+
+    with open(filename, "rb") as file:
+        def read_bytes(addr, num_bytes):
+            file.seek(content_start + addr)
+            return file.read(max(0, min(num_bytes, rom_size - addr)))
+        rom_type, internal_header = _detect_rom_type(rom_size, read_bytes)
+
+    if len(internal_header) < _INTERNAL_HEADER_SIZE:
+        raise AssertionError(f"{filename} is too small to contain an internal header")
+    makeup_byte = internal_header[0x15]
+    _check_makeup_byte(rom_type, makeup_byte)
+    complement, checksum = struct.unpack_from("<HH", internal_header, 0x1C)
+    return {
+        "file_size": file_size,
+        "headered": headered,
+        "rom_size": rom_size,
+        "type": rom_type,
+        "title": internal_header[:21].decode("ascii", errors="replace").rstrip(" \x00"),
+        "makeup_byte": makeup_byte,
+        "rom_size_code": internal_header[0x17],
+        "checksum": checksum,
+        "checksum_complement": complement,
+        "checksum_valid": complement + checksum == 0xFFFF,
+    }
+
+class AccessStats:
+    #what RomHandler.enable_instrumentation() collects: calls, time (including anything called from inside), and bytes
+    # for each instrumented method, plus how many bytes were read from and written to each SNES bank.
+    #an access only counts once, even if (for instance) read_from_snes_address() ends up calling read()
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.seconds = collections.Counter()
+        self.bytes = collections.Counter()
+        self.bank_reads = np.zeros(0x100, dtype=np.int64)     #bytes, by SNES bank
+        self.bank_writes = np.zeros(0x100, dtype=np.int64)
+        self._depth = 0     #how many instrumented methods are currently running
+
+    def reset(self):
+        self.__init__()
+
+    def to_dict(self):
+        banks = {}
+        for bank in np.flatnonzero(self.bank_reads | self.bank_writes).tolist():
+            banks[f"0x{bank:02X}"] = {"read": int(self.bank_reads[bank]), "write": int(self.bank_writes[bank])}
+        return {
+            "methods": {name: {"calls": self.calls[name], "seconds": self.seconds[name], "bytes": self.bytes[name]}
+                        for name in sorted(self.calls)},
+            "banks": banks,
+        }
+
+    def to_json(self, filename=None):
+        #returns the stats as a JSON string, and also writes them to filename if one is given
+        text = json.dumps(self.to_dict(), indent=2)
+        if filename is not None:
+            with open(filename, "w") as file:
+                file.write(text)
+        return text
+
+    def _record_access(self, rom, name, is_write, addr, num_bytes):
+        #only what is inside the ROM counts, since e.g. bulk_read() just returns fewer bytes if it runs off the end
+        end = min(addr + num_bytes, rom._rom_size)
+        addr = max(0, addr)
+        self.bytes[name] += max(0, end - addr)
+        histogram = self.bank_writes if is_write else self.bank_reads
+        while addr < end:       #split the access up at each half bank, since each one could be in a different SNES bank
+            half_bank_end = min(end, (addr | 0x7FFF) + 1)
+            snes_address = rom._snes_address_map[addr >> 15]
+            if snes_address >= 0:
+                histogram[snes_address >> 16] += half_bank_end - addr
+            addr = half_bank_end
+
+def _encoding_size(encoding):
+    return encoding if type(encoding) is int else _get_encoding_plan(encoding).size
+
+def _table_size(encoding, count, stride):
+    if count == 0:
+        return 0
+    size = _encoding_size(encoding)
+    return size*count if stride is None else stride*(count-1) + size
+
+def _snes_to_pc(rom, addr):
+    return RomHandler.convert_to_pc_address(rom, addr)     #straight to the class, so that this does not get counted
+
+#the methods that instrumentation wraps, and for the ones that touch the ROM, how to tell what they touched:
+# a function of (rom, *the method's arguments) that returns (is a write, PC address, number of bytes)
+_INSTRUMENTED_METHODS = {
+    "read":        lambda rom, addr, encoding: (False, addr, _encoding_size(encoding)),
+    "write":       lambda rom, addr, values, encoding: (True, addr, _encoding_size(encoding)),
+    "read_many":   lambda rom, addr, encoding, count, stride=None: (False, addr, _table_size(encoding, count, stride)),
+    "write_many":  lambda rom, addr, values, encoding, stride=None: (True, addr, _table_size(encoding, len(values), stride)),
+    "bulk_read":   lambda rom, addr, num_bytes: (False, addr, num_bytes),
+    "bulk_write":  lambda rom, addr, values, num_bytes: (True, addr, num_bytes),
+    "view":        lambda rom, addr, num_bytes, dtype=None, writable=False: (writable, addr, num_bytes),
+    "read_from_snes_address":       lambda rom, addr, encoding: (False, _snes_to_pc(rom, addr), _encoding_size(encoding)),
+    "write_to_snes_address":        lambda rom, addr, values, encoding: (True, _snes_to_pc(rom, addr), _encoding_size(encoding)),
+    "bulk_read_from_snes_address":  lambda rom, addr, num_bytes: (False, _snes_to_pc(rom, addr), num_bytes),
+    "bulk_write_to_snes_address":   lambda rom, addr, values, num_bytes: (True, _snes_to_pc(rom, addr), num_bytes),
+    "view_from_snes_address":       lambda rom, addr, num_bytes, dtype=None, writable=False: (writable, _snes_to_pc(rom, addr), num_bytes),
+    "convert_to_snes_address":   None,
+    "convert_to_pc_address":     None,
+    "convert_to_snes_addresses": None,
+    "convert_to_pc_addresses":   None,
+    "_get_checksum":             None,
+}
+
+#runs of free space shorter than this are not worth indexing
+_FREE_SPACE_MIN_RUN = 0x10
+
+class _FreeSpaceIndex:
+    #keeps track of the runs of fill bytes in a ROM that have not been handed out by allocate().
+    #free is one boolean per byte of the ROM, and the runs (at least min_run bytes long) that it contains are kept
+    # sorted in starts/ends.  Pages that get written to are collected in stale_pages (RomHandler._mark_dirty() adds
+    # them), and only those are looked at again when the index is next used.
+    def __init__(self, contents, fill, min_run=_FREE_SPACE_MIN_RUN):
+        self.fill = fill
+        self.min_run = min_run
+        self.free = np.frombuffer(contents, dtype=np.uint8) == fill
+        self.starts, self.ends = self._runs_between(0, len(self.free))
+        self.claimed = []           #sorted (start, end) of everything that allocate() has handed out
+        self.stale_pages = set()
+        self._shared = False        #whether free, starts, ends, and claimed might also belong to a copy of this index
+
+    def copy(self):
+        #the copy shares everything with this index until one of them changes, which is when that one gets its own.
+        #forks are made a lot more often than they allocate anything, so this saves copying one boolean per byte each time
+        index = copy.copy(self)
+        index.stale_pages = set(self.stale_pages)
+        self._shared = index._shared = True
+        return index
+
+    def _unshare(self):
+        if self._shared:
+            self.free = self.free.copy()
+            self.starts, self.ends = list(self.starts), list(self.ends)
+            self.claimed = list(self.claimed)
+            self._shared = False
+
+    def refresh(self, contents, page_size):
+        #brings the index up to date with any pages that have been written to since it was last used
+        if not self.stale_pages:
+            return
+        self._unshare()
+        pages = np.zeros(len(self.free)//page_size, dtype=bool)
+        pages[list(self.stale_pages)] = True
+        self.stale_pages.clear()
+        page_starts, page_ends = _find_runs(pages)
+        bytes_view = np.frombuffer(contents, dtype=np.uint8)
+        for start, end in zip(page_starts, page_ends):
+            start, end = start*page_size, end*page_size
+            self.free[start:end] = bytes_view[start:end] == self.fill
+            for claim_start, claim_end in self._claims_between(start, end):
+                self.free[max(start, claim_start):min(end, claim_end)] = False
+            self._reindex(start, end)
+
+    def claim(self, start, end):
+        self._unshare()
+        self.free[start:end] = False
+        bisect.insort(self.claimed, (start, end))
+        self._reindex(start, end)
+
+    def _reindex(self, start, end):
+        #works out the runs again around [start, end).  Any run that is partly outside this window, but could be joined
+        # to the free bytes inside it, is either already indexed (so the window grows to include it) or is shorter
+        # than min_run (so it is within min_run of the window)
+        start = max(0, start - self.min_run)
+        end = min(len(self.free), end + self.min_run)
+        first = bisect.bisect_left(self.ends, start)        #the first run that ends at or after start
+        last = bisect.bisect_right(self.starts, end)        #one past the last run that starts at or before end
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last-1])
+        self.starts[first:last], self.ends[first:last] = self._runs_between(start, end)
+
+    def _runs_between(self, start, end):
+        starts, ends = _find_runs(self.free[start:end])
+        runs = [(start+run_start, start+run_end) for run_start, run_end in zip(starts, ends) if run_end-run_start >= self.min_run]
+        return [run[0] for run in runs], [run[1] for run in runs]
+
+    def _claims_between(self, start, end):
+        first = max(0, bisect.bisect_left(self.claimed, (start, start)) - 1)
+        for claim_start, claim_end in self.claimed[first:]:
+            if claim_start >= end:
+                break
+            if claim_end > start:
+                yield claim_start, claim_end
+
+class _SearchIndex:
+    #every 3 byte sequence in the ROM, sorted, along with where it occurs.  A search looks up the rarest 3 bytes of its
+    # pattern here and then only has to check the rest of the pattern at those few places.
+    #pages that have been written to since the index was built are collected in stale_pages (see
+    # RomHandler._mark_dirty()).  The index says nothing reliable about those, so they are searched directly instead.
+    def __init__(self, contents):
+        data = np.frombuffer(contents, dtype=np.uint8)
+        grams = _get_3_grams(data)
+        self.positions = np.argsort(grams, kind="stable").astype(np.uint32)     #stable, so each gram's positions are in order
+        self.sorted_grams = grams[self.positions]
+        self.stale_pages = set()
+
+    def copy(self):
+        #the arrays never change once built, so they can be shared
+        index = copy.copy(self)
+        index.stale_pages = set(self.stale_pages)
+        return index
+
+    def count(self, gram):
+        return int(np.searchsorted(self.sorted_grams, gram, "right") - np.searchsorted(self.sorted_grams, gram, "left"))
+
+    def lookup(self, gram):
+        return self.positions[np.searchsorted(self.sorted_grams, gram, "left"):np.searchsorted(self.sorted_grams, gram, "right")]
+
+def _get_3_grams(data):
+    #each 3 byte sequence in data, as a single number, indexed by where it starts
+    data = data.astype(np.uint32)
+    return (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+
+def _parse_search_pattern(pattern):
+    #a pattern can be bytes, a list of byte values with None as a wildcard, or a string of hex with ?? as a wildcard
+    # (e.g. "A9 ?? 8D 00 21").  Returns the byte values and a mask of which ones have to match
+    if isinstance(pattern, (bytes, bytearray, memoryview)):
+        values = list(bytes(pattern))
+    elif isinstance(pattern, str):
+        digits = "".join(pattern.split())
+        if len(digits) % 2 != 0:
+            raise AssertionError(f"search pattern {pattern} does not contain a whole number of bytes")
+        values = [None if digits[i:i+2] == "??" else int(digits[i:i+2], 16) for i in range(0, len(digits), 2)]
+    else:
+        values = list(pattern)
+    if not values or all(value is None for value in values):
+        raise AssertionError(f"search pattern {pattern} does not have any bytes to match")
+    mask = np.array([value is not None for value in values], dtype=bool)
+    return np.array([0 if value is None else value for value in values], dtype=np.uint8), mask
+
 class RomHandler:
-    def __init__(self, filename):
-        #internal constants
-        self._HEADER_SIZE = 0x200
-        self._MEGABIT = 0x20000
+    def __init__(self, filename, mmap_mode=None):
+        #mmap_mode can be used to avoid reading the whole file up front:
+        #  None -- (default) read the entire file into memory
+        #  "r"  -- map the file read-only; pages are only loaded from disk as they are accessed
+        #  "c"  -- map the file copy-on-write; writes stay in memory and never touch the original file
+        #to make a handler from something other than a file on disk, see from_bytes(), from_buffer(), from_stream(), and from_archive()
+        if mmap_mode not in [None, "r", "c"]:
+            raise AssertionError(f"mmap_mode must be None, 'r', or 'c', not {mmap_mode}")
+        self._initialize_state(mmap_mode)
 
         #figure out if it has a header by inferring from the overall file size
-        file_size = os.path.getsize(filename)
-        if file_size % 0x8000 == 0:
-            self._rom_is_headered = False
-            self._rom_size = file_size
-        elif file_size % 0x8000 == self._HEADER_SIZE:
-            self._rom_is_headered = True
-            self._rom_size = file_size - self._HEADER_SIZE
-        else:
-            raise AssertionError(f"{filename} does not contain an even number of half banks...is this a valid ROM?")
+        self._rom_is_headered, self._rom_size = _split_file_size(os.path.getsize(filename), self._HEADER_SIZE, filename)
 
         #open the file and store the contents
         with open(filename, "rb") as file:
-            if self._rom_is_headered:
-                self._header = bytearray(file.read(self._HEADER_SIZE))
-            self._contents = bytearray(file.read())
-            
-        #Determine the type of ROM (e.g. LoRom or HiRom)
-        #by comparing against checksum complement
-        LOWER_ASCII = 0x20
-        UPPER_ASCII = 0x7E
-        ROM_TITLE_SIZE = 21
-        if self._rom_size > 32*self._MEGABIT: #larger than 32 MBit
-            EXLOROM_CHECKSUM_OFFSET = 0x407FDE
-            EXHIROM_CHECKSUM_OFFSET = 0x40FFDE
-            if self.read(EXLOROM_CHECKSUM_OFFSET, 2) + self.read(EXLOROM_CHECKSUM_OFFSET-2, 2) == 0xFFFF:
-                self._type = RomType.EXLOROM
-            elif self.read(EXHIROM_CHECKSUM_OFFSET, 2) + self.read(EXHIROM_CHECKSUM_OFFSET-2, 2) == 0xFFFF:
-                self._type = RomType.EXHIROM
-            else:   #the checksum is bad, so try to infer from the internal header being valid characters or not 
-                lorom_char_count = sum(x >= LOWER_ASCII and x <= UPPER_ASCII for x in self.read(0x407FC0, "1"*ROM_TITLE_SIZE))
-                hirom_char_count = sum(x >= LOWER_ASCII and x <= UPPER_ASCII for x in self.read(0x40FFC0, "1"*ROM_TITLE_SIZE))
-                if lorom_char_count >= hirom_char_count:
-                    self._type = RomType.EXLOROM
-                else:
-                    self._type = RomType.EXHIROM
-        else:
-            LOROM_CHECKSUM_OFFSET = 0x7FDE
-            HIROM_CHECKSUM_OFFSET = 0xFFDE
-            if self.read(LOROM_CHECKSUM_OFFSET, 2) + self.read(LOROM_CHECKSUM_OFFSET-2, 2) == 0xFFFF:
-                self._type = RomType.LOROM
-            elif self.read(HIROM_CHECKSUM_OFFSET, 2) + self.read(HIROM_CHECKSUM_OFFSET-2, 2) == 0xFFFF:
-                self._type = RomType.HIROM
-            else:   #the checksum is bad, so try to infer from the internal header being valid characters or not 
-                lorom_char_count = sum(x >= LOWER_ASCII and x <= UPPER_ASCII for x in self.read(0x7FC0, "1"*ROM_TITLE_SIZE))
-                hirom_char_count = sum(x >= LOWER_ASCII and x <= UPPER_ASCII for x in self.read(0xFFC0, "1"*ROM_TITLE_SIZE))
-                if lorom_char_count >= hirom_char_count:
-                    self._type = RomType.LOROM
-                else:
-                    self._type = RomType.HIROM
-
-        #check to make sure the makeup byte confirms our determination of the ROM type
-        makeup_byte = self._read_from_internal_header(0x15, 1)
-        if self._type == RomType.LOROM and makeup_byte in [0x20,0x30]:
-            pass    #lorom confirmed
-        elif self._type == RomType.HIROM and makeup_byte in [0x21, 0x31]:
-            pass    #hirom confirmed 
-        elif (self._type == RomType.LOROM or self._type == RomType.HIROM) and makeup_byte == 0x23:
-            pass    #Maybe SA-1 will work with this library.  MAYBE.
-        elif self._type == RomType.EXLOROM and makeup_byte == 0x32:
-            pass    #exlorom confirmed
-        elif self._type == RomType.EXHIROM and makeup_byte == 0x35:
-            pass    #exhirom confirmed
+            if mmap_mode is None:
+                if self._rom_is_headered:
+                    self._header = bytearray(file.read(self._HEADER_SIZE))
+                self._contents = _read_stream(file, self._rom_size)
+            else:
+                #the mapping has to start at a multiple of the allocation granularity, so map the whole file
+                # and then take a view that skips over the header, if there is one
+                access = mmap.ACCESS_READ if mmap_mode == "r" else mmap.ACCESS_COPY
+                self._mmap = mmap.mmap(file.fileno(), 0, access=access)
+                self._source_filename = os.path.abspath(filename)
+                content_start = self._HEADER_SIZE if self._rom_is_headered else 0
+                if self._rom_is_headered:
+                    self._header = bytearray(self._mmap[:self._HEADER_SIZE])
+                self._contents = memoryview(self._mmap)[content_start:]
+
+        self._identify()
+
+
+    @classmethod
+    def from_bytes(cls, data):
+        #makes a handler for a ROM image (with or without a copier header) that is already in memory.
+        #the handler gets its own copy of the data
+        return cls._from_image(data, name="<bytes>")
+
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        #like from_bytes(), except that a bytearray without a copier header is used as it is instead of being copied,
+        # so the buffer sees every change made through the handler.
+        #the handler reads whatever is in the buffer, but it does not know when the buffer is written to directly, so
+        # call refresh() after doing that, or else the checksum and the allocate()/search() indexes will be out of date
+        return cls._from_image(buffer, share=True, name="<buffer>")
+
+
+    @classmethod
+    def from_stream(cls, stream, size=None):
+        #reads a ROM image from a file-like object (an open file, a pipe, a member of an archive, ...) straight into memory.
+        #if size is given, exactly that many bytes are read into a buffer of that size; otherwise it reads to the end
+        return cls._from_image(_read_stream(stream, size), owned=True, name="<stream>")
+
+
+    @classmethod
+    def from_archive(cls, source, member=None):
+        #reads a ROM out of a zip, gzip, bz2, or xz file (given as a filename, the bytes of the file, or a file-like object)
+        # without writing it anywhere else first.  Anything else is read as a plain ROM image.
+        #for a zip, member is the name of the file to use.  By default it is the only file in there, or else the only one
+        # that looks like a ROM.
+        #7z is not supported, since the standard library cannot read it
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as file:
+                return cls.from_archive(file, member)
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return cls.from_archive(io.BytesIO(source), member)
+
+        if hasattr(source, "peek") or not hasattr(source, "readinto") or _is_seekable(source):
+            return cls._from_archive_stream(source, member)
+        #put a buffer in front of the stream so that the start can be looked at without reading the whole thing.  It is
+        # detached afterwards, since closing it would close the stream too
+        buffered_source = io.BufferedReader(source)
+        try:
+            return cls._from_archive_stream(buffered_source, member)
+        finally:
+            buffered_source.detach()
+
+
+    @classmethod
+    def _from_archive_stream(cls, source, member):
+        if hasattr(source, "peek"):
+            magic = source.peek(6)[:6]
+        elif _is_seekable(source):
+            magic = source.read(6)
+            source.seek(-len(magic), os.SEEK_CUR)
         else:
-            raise AssertionError(f"Cannot recognize the makeup byte of this ROM: {hex(makeup_byte)}.")
+            #something that can only be read from (not even into a buffer), so what is read to identify it has to be kept
+            magic = source.read(6)
+            source = io.BytesIO(magic + source.read())
+
+        if magic.startswith(b"PK\x03\x04"):
+            if not source.seekable():
+                source = io.BytesIO(source.read())      #the directory of a zip is at the end, so it has to be read in full
+            with zipfile.ZipFile(source) as archive:
+                info = _choose_archive_member(archive, member)
+                with archive.open(info) as file:
+                    return cls.from_stream(file, info.file_size)
+        elif magic.startswith(b"\x1f\x8b"):
+            with gzip.GzipFile(fileobj=source) as file:
+                return cls.from_stream(file)
+        elif magic.startswith(b"BZh"):
+            with bz2.BZ2File(source) as file:
+                return cls.from_stream(file)
+        elif magic.startswith(b"\xfd7zXZ\x00"):
+            with lzma.LZMAFile(source) as file:
+                return cls.from_stream(file)
+        elif magic.startswith(b"7z\xbc\xaf\x27\x1c"):
+            raise NotImplementedError("Not Implemented to read 7z archives.  Extract the ROM first, or repack it as zip/gzip/xz.")
+        return cls.from_stream(source)
+
+
+    @classmethod
+    def _from_image(cls, image, share=False, owned=False, name="<buffer>"):
+        #image is the whole ROM image, copier header and all.  With share, a headerless bytearray becomes the contents
+        # as it is.  With owned, the caller is giving up a bytearray, so it can be used as the contents even if the
+        # header has to be cut off the front of it first.
+        rom = cls.__new__(cls)
+        rom._initialize_state(None)
+        with memoryview(image) as raw_view, raw_view.cast("B") as view:
+            rom._rom_is_headered, rom._rom_size = _split_file_size(view.nbytes, rom._HEADER_SIZE, name)
+            content_start = rom._HEADER_SIZE if rom._rom_is_headered else 0
+            if rom._rom_is_headered:
+                rom._header = bytearray(view[:content_start])
+            reuse = isinstance(image, bytearray) and (owned or (share and not rom._rom_is_headered))
+            if not reuse:
+                rom._contents = bytearray(view[content_start:])
+        if reuse:
+            del image[:content_start]
+            rom._contents = image
+        rom._identify()
+        return rom
+
+
+    def _initialize_state(self, mmap_mode):
+        self._mmap_mode = mmap_mode
+        self._mmap = None
+        self._source_filename = None
+        self._fork_snapshot = None      #a frozen copy of the contents that forks can share, see fork()
+        self._writable_views = []       #(weak reference, address, size) for each writable view(), see _catch_up_with_views()
+        self._access_stats = None       #see enable_instrumentation()
+
+        #sets of pages that want to hear about writes: _mark_dirty() adds every page that is about to change to each of them
+        self._write_listeners = []
+        self._free_space_indexes = {}     #by fill byte, see allocate()
+        self._search_index = None         #see search()
+
+        #internal constants
+        self._HEADER_SIZE = _COPIER_HEADER_SIZE
+        self._MEGABIT = 0x20000
+        self._PAGE_SIZE = 0x400     #granularity at which changes to the contents are tracked
+
+        #pages that have been written to since the ROM was loaded, along with the sum of their original bytes.
+        #this lets the checksum be updated by looking at only the changed pages instead of the whole ROM
+        self._dirty_pages = {}
+        self._checksum_base = None     #the (weighted) byte sum of the ROM as it was loaded, computed when first needed
+
+
+    def refresh(self):
+        #forgets everything that was worked out from the contents, for when they have been changed without going through
+        # this handler (e.g. a buffer given to from_buffer()).  The checksum and the indexes get worked out again when
+        # they are next needed.
+        #note that space handed out by allocate() before this is no longer held back, and that save(in_place=True)
+        # still only writes the pages that were written through the handler
+        self._checksum_base = None
+        self._fork_snapshot = None
+        self._forget_indexes()
+
+
+    def _identify(self):
+        #Determine the type of ROM (e.g. LoRom or HiRom)
+        self._type, _ = _detect_rom_type(self._rom_size, lambda addr, num_bytes: self._contents[addr:addr+num_bytes])
+
+        #now that the type is known, the address translation tables can be built
+        self._build_bank_maps()
+
+        _check_makeup_byte(self._type, self._read_from_internal_header(0x15, 1))
 
         #information about onboard RAM/SRAM and enhancement chips lives here
         #rom_type_byte = self._read_from_internal_header(0x16, 1)
@@ -96,19 +689,68 @@ class RomHandler:
         #self._SRAM_size = 0x400 << self._read_from_internal_header(0x18,1)
 
 
-    def save(self, filename, overwrite=False,fix_checksum=True):
+    def save(self, filename, overwrite=False,fix_checksum=True,in_place=False,atomic=False):
+        #in_place=True is for when filename already holds the ROM that this handler was loaded from (e.g. the file it was
+        # opened from, or an earlier save of that same ROM).  Instead of rewriting the whole file, only the pages that have
+        # changed since loading (plus the copier header, if there is one) are written over it.  This implies overwrite.
+        #atomic=True writes everything to a temporary file next to filename and then renames it over filename, so anyone
+        # reading filename at the same time sees either the old ROM or the new one, and never something half-written.
+        #a ROM opened with mmap_mode='r' cannot be written to, so for that one the fixed checksum only goes into the file
+        if in_place and atomic:
+            raise AssertionError("save() can be in_place or atomic, but not both")
+
         #check to see if a file by this name already exists
-        if not overwrite and os.path.isfile(filename):
+        if not overwrite and not in_place and os.path.isfile(filename):
             raise FileExistsError(f"{filename} already exists")
 
         # fix checksum
-        if fix_checksum:
-            self._fix_checksum()
+        checksum_patch = self._prepare_checksum() if fix_checksum else None
+
+        if in_place:
+            self._save_in_place(filename, checksum_patch)
+            return
+        if atomic:
+            #the rename gives filename a new file, so even if it is mapped right now, the mapping is not disturbed
+            self._save_atomically(filename, checksum_patch)
+            return
+
+        #opening the mapped file for writing would truncate it out from under the mapping,
+        # so in that case pull everything into memory first
+        if self._mmap is not None and self._source_filename is not None and \
+                os.path.isfile(filename) and os.path.samefile(filename, self._source_filename):
+            self._detach_from_mmap()
 
         with open(filename, "wb") as file:
-            if self._rom_is_headered:
-                file.write(self._header)
+            self._write_image(file, checksum_patch)
+
+
+    def save_to_stream(self, stream, fix_checksum=True):
+        #writes the ROM (with its copier header, if it has one) to a file-like object, e.g. a pipe or an archive member
+        checksum_patch = self._prepare_checksum() if fix_checksum else None
+        self._write_image(stream, checksum_patch)
+
+
+    def _prepare_checksum(self):
+        #fixes the checksum, or if the ROM is read-only, returns (PC address, bytes) of the fixed checksum for the
+        # output to have instead
+        if self._mmap_mode == "r":
+            return self._get_checksum_fix()
+        self._fix_checksum()
+        return None
+
+
+    def _write_image(self, file, patch=None):
+        #patch is (PC address, bytes) to write in place of what the contents have there
+        if self._rom_is_headered:
+            file.write(self._header)
+        if patch is None:
             file.write(self._contents)
+        else:
+            addr, data = patch
+            with memoryview(self._contents) as contents:
+                file.write(contents[:addr])
+                file.write(data)
+                file.write(contents[addr+len(data):])
 
 
     def read(self,addr,encoding):
@@ -126,18 +768,42 @@ class RomHandler:
         if type(encoding) is int:
             return self._read_single(addr,encoding)
         elif type(encoding) is str:
-            returnvalue = []
-            for code in encoding:
-                size = int(code)
-                returnvalue.append(self._read_single(addr, size))
-                addr += size
-            return returnvalue
+            plan = _get_encoding_plan(encoding)
+            if addr < 0 or addr+plan.size > self._rom_size:
+                raise AssertionError(f"function read() called for address beyond ROM file boundary: {hex(addr)}, encoding {encoding}")
+            return plan.unpack_from(self._contents, addr)
         else:
             raise AssertionError(f"received call to read() but the encoding was not recognized: {encoding}")
 
+    def read_many(self,addr,encoding,count,stride=None):
+        #reads a whole table of records in one go.  Each record is read as in read(), and the records start stride bytes apart
+        # (by default, right after each other).  Returns a list with one entry per record.
+        #example: .read_many(0x8000, "21", 3) will read the same thing as [.read(0x8000,"21"), .read(0x8003,"21"), .read(0x8006,"21")]
+        if type(encoding) is not int and type(encoding) is not str:
+            raise AssertionError(f"received call to read_many() but the encoding was not recognized: {encoding}")
+        plan = _get_encoding_plan(encoding, stride)
+        if count <= 0:
+            return []
+        end_addr = addr + plan.stride*(count-1) + plan.size
+        if addr < 0 or end_addr > self._rom_size:
+            raise AssertionError(f"function read_many() called for addresses beyond ROM file boundary: {hex(addr)}-{hex(end_addr)}")
+
+        table_end = addr + plan.stride*count
+        if plan.padded_struct is not None and table_end <= self._rom_size:
+            raw_records = plan.padded_struct.iter_unpack(memoryview(self._contents)[addr:table_end])
+        else:
+            raw_records = (plan.struct.unpack_from(self._contents, record_addr) for record_addr in range(addr, table_end, plan.stride))
+
+        if type(encoding) is int:
+            if encoding == 3:
+                return [record[0] | (record[1] << 16) for record in raw_records]
+            return [record[0] for record in raw_records]
+        else:
+            return [plan.merge(record) for record in raw_records]
+
     def bulk_read(self,addr,num_bytes):
         #for large reads, the read() function is too slow.  This returns the raw byte data.
-        return self._contents[addr:addr+num_bytes].copy()
+        return bytearray(self._contents[addr:addr+num_bytes])
 
     def write(self,addr,values,encoding):
         #if encoding is an integer:
@@ -159,25 +825,87 @@ class RomHandler:
                 raise AssertionError(f"received call to do multiple writes, but only one value was given.  Should encoding be an integer instead of a string?")
             if len(values) != len(encoding):
                 raise AssertionError(f"received call to write() but length of values and encoding did not match: i.e. {len(values)} vs. {len(encoding)}")
-            for value,code in zip(values,encoding):
-                size = int(code)
-                self._write_single(value, addr, size)
-                addr += size
+            plan = _get_encoding_plan(encoding)
+            if addr < 0 or addr+plan.size > self._rom_size:
+                raise AssertionError(f"function write() called for address beyond ROM file boundary: {hex(addr)}, encoding {encoding}")
+            self._mark_dirty(addr, plan.size)
+            plan.pack_into(self._contents, addr, values)
         else:
             raise AssertionError(f"received call to write() but the encoding was not recognized: {encoding}")
 
+    def write_many(self,addr,values,encoding,stride=None):
+        #the counterpart to read_many(): writes a whole table of records in one go.
+        #values should have one entry per record, and each entry is written as in write()
+        #example: .write_many(0x8000, [[1,2],[3,4]], "21") will write $01 $00 $02 $03 $00 $04 to 0x8000-0x8005
+        if type(encoding) is not int and type(encoding) is not str:
+            raise AssertionError(f"received call to write_many() but the encoding was not recognized: {encoding}")
+        plan = _get_encoding_plan(encoding, stride)
+        if not values:
+            return
+        end_addr = addr + plan.stride*(len(values)-1) + plan.size
+        if addr < 0 or end_addr > self._rom_size:
+            raise AssertionError(f"function write_many() called for addresses beyond ROM file boundary: {hex(addr)}-{hex(end_addr)}")
+
+        table_end = addr + plan.stride*len(values)
+        self._mark_dirty(addr, end_addr-addr)
+        pack_into = plan.pack_into
+        contents = self._contents
+        if type(encoding) is int:
+            for record_addr,value in zip(range(addr, table_end, plan.stride), values):
+                pack_into(contents, record_addr, (value,))
+        else:
+            for record_addr,record in zip(range(addr, table_end, plan.stride), values):
+                if len(record) != plan.length:
+                    raise AssertionError(f"received call to write_many() but length of values and encoding did not match: i.e. {len(record)} vs. {plan.length}")
+                pack_into(contents, record_addr, record)
+
     def bulk_write(self,addr,values,num_bytes):
         if len(values) != num_bytes:
             raise AssertionError("call to bulk_write() with data not of length specified")
         else:
+            self._mark_dirty(addr, num_bytes)
             self._contents[addr:addr+num_bytes] = bytearray(values)
 
+    def view(self,addr,num_bytes,dtype=None,writable=False):
+        #like bulk_read(), but does not copy anything.  Returns a memoryview of the ROM from addr to addr+num_bytes,
+        # or if dtype is given (e.g. a numpy structured dtype describing one record of a table), a numpy array of records.
+        #with writable=True, anything written into the view goes straight into the ROM.
+        #Note: the view is tied to the current contents, so do not hold on to it across expand().
+        if addr < 0 or addr+num_bytes > self._rom_size:
+            raise AssertionError(f"function view() called for address beyond ROM file boundary: {hex(addr)}, size {num_bytes}")
+        if writable:
+            #there is no way to see writes through the view, so assume they all happen: now, and again whenever something
+            # needs to know about every write (see _catch_up_with_views()), for as long as the view is around.
+            #the view is made from a numpy array, which it keeps alive, so a weak reference to that says when it is gone
+            self._mark_dirty(addr, num_bytes)
+            exporter = np.frombuffer(self._contents, dtype=np.uint8, count=num_bytes, offset=addr)
+            self._writable_views.append((weakref.ref(exporter), addr, num_bytes))
+            buffer = memoryview(exporter)
+        else:
+            buffer = memoryview(self._contents)[addr:addr+num_bytes].toreadonly()
+        if dtype is None:
+            return buffer
+
+        dtype = np.dtype(dtype)
+        if num_bytes % dtype.itemsize != 0:
+            raise AssertionError(f"function view() called with {num_bytes} bytes, which is not a whole number of {dtype.itemsize} byte records")
+        return np.frombuffer(buffer, dtype=dtype)
+
     def read_from_snes_address(self,addr,encoding):
         return self.read(self.convert_to_pc_address(addr),encoding)
 
     def bulk_read_from_snes_address(self,addr,num_bytes):
         return self.bulk_read(self.convert_to_pc_address(addr),num_bytes)
 
+    def view_from_snes_address(self,addr,num_bytes,dtype=None,writable=False):
+        #the view has to stay inside one bank, and that part of the bank has to be one contiguous run of ROM
+        if (addr & 0xFFFF) + num_bytes > 0x10000:
+            raise AssertionError(f"function view_from_snes_address() called on {hex(addr)} with size {hex(num_bytes)}, but this crosses a bank boundary.")
+        pc_address = self.convert_to_pc_address(addr)
+        if num_bytes > 0 and self.convert_to_pc_address(addr+num_bytes-1) != pc_address+num_bytes-1:
+            raise AssertionError(f"function view_from_snes_address() called on {hex(addr)} with size {hex(num_bytes)}, but this is not contiguous in ROM.")
+        return self.view(pc_address,num_bytes,dtype,writable)
+
     def write_to_snes_address(self,addr,values,encoding):
         return self.write(self.convert_to_pc_address(addr),values,encoding)
 
@@ -188,6 +916,51 @@ class RomHandler:
         #takes as input a PC ROM address and converts it into the address space of the SNES
         if addr > self._rom_size or addr < 0:
             raise AssertionError(f"Function convert_to_snes_address() called on {hex(addr)}, but this is outside the ROM file.")
+        snes_address = self._snes_address_map[addr >> 15]
+        if snes_address < 0:
+            raise AssertionError(f"Function convert_to_snes_address() called on {hex(addr)}, but this part of ROM is not mapped in {self._type.name}.")
+        return snes_address + (addr & 0x7FFF)
+
+
+    def convert_to_pc_address(self, addr):
+        #takes as input an address in the SNES address space and maps it to the correct address in the PC ROM.
+        if addr > 0xFFFFFF or addr < 0:
+            raise AssertionError(f"Function convert_to_pc_address() called on {hex(addr)}, but this is outside SNES address space.")
+        pc_address = self._pc_address_map[addr >> 15]
+        if pc_address < 0:
+            raise AssertionError(f"Function convert_to_pc_address() called on {hex(addr)}, but this does not map to ROM.")
+        return pc_address + (addr & 0x7FFF)
+
+
+    def convert_to_snes_addresses(self, addrs):
+        #batch version of convert_to_snes_address(): takes an array of PC ROM addresses and returns a numpy array
+        addrs = np.asarray(addrs, dtype=np.int64)
+        if addrs.size and (addrs.min() < 0 or addrs.max() > self._rom_size):
+            raise AssertionError("Function convert_to_snes_addresses() called on addresses outside the ROM file.")
+        snes_addresses = self._snes_address_array[addrs >> 15]
+        unmapped = snes_addresses < 0
+        if unmapped.any():
+            raise AssertionError(f"Function convert_to_snes_addresses() called on {hex(addrs[unmapped][0])}, but this part of ROM is not mapped in {self._type.name}.")
+        return snes_addresses + (addrs & 0x7FFF)
+
+
+    def convert_to_pc_addresses(self, addrs):
+        #batch version of convert_to_pc_address(): takes an array of SNES addresses and returns a numpy array
+        addrs = np.asarray(addrs, dtype=np.int64)
+        if addrs.size and (addrs.min() < 0 or addrs.max() > 0xFFFFFF):
+            raise AssertionError("Function convert_to_pc_addresses() called on addresses outside SNES address space.")
+        pc_addresses = self._pc_address_array[addrs >> 15]
+        unmapped = pc_addresses < 0
+        if unmapped.any():
+            raise AssertionError(f"Function convert_to_pc_addresses() called on {hex(addrs[unmapped][0])}, but this does not map to ROM.")
+        return pc_addresses + (addrs & 0x7FFF)
+
+
+    def _compute_snes_address(self, addr):
+        #the long way to convert a PC ROM address into the address space of the SNES.
+        #only used to build the tables that convert_to_snes_address() looks things up in
+        if addr > self._rom_size or addr < 0:
+            raise AssertionError(f"Function _compute_snes_address() called on {hex(addr)}, but this is outside the ROM file.")
         
         if self._type == RomType.LOROM:
             bank = addr // 0x8000
@@ -200,33 +973,34 @@ class RomHandler:
         elif self._type == RomType.EXLOROM:
             bank = addr // 0x8000
             offset = addr % 0x8000
-            if bank < 0x40:
+            if bank < 0x80:
                 snes_address = (bank+0x80)*0x10000 + (offset+0x8000)
-            elif bank < 0x7F:
+            elif bank < 0xFE:
                 snes_address = (bank-0x80)*0x10000 + (offset+0x8000)
             else:
-                raise AssertionError(f"Function convert_to_snes_address() called on address {hex(addr)}, but this part of ROM is not mapped in ExLoRom.")
+                raise AssertionError(f"Function _compute_snes_address() called on address {hex(addr)}, but this part of ROM is not mapped in ExLoRom.")
                 
         elif self._type == RomType.EXHIROM:
             if addr < 0x400000:
                 snes_address = addr + 0xC00000
             elif addr < 0x7E0000:
                 snes_address = addr
-            elif addr % 0x10000 > 0x8000:   #only the upper banks of this last little bit are mapped
+            elif addr % 0x10000 >= 0x8000:   #only the upper banks of this last little bit are mapped
                 snes_address = addr - 0x400000    #for instance, 0x7E8000 PC is mapped to 0x3E8000 SNES
             else:
-                raise AssertionError(f"Function convert_to_snes_address() called on {hex(addr)}, but this part of ROM is not mapped in ExHiRom.")
+                raise AssertionError(f"Function _compute_snes_address() called on {hex(addr)}, but this part of ROM is not mapped in ExHiRom.")
 
         else:
-            raise NotImplementedError(f"Function convert_to_snes_address() called with not implemented type {self._type}")
+            raise NotImplementedError(f"Function _compute_snes_address() called with not implemented type {self._type}")
 
         return snes_address
     
         
-    def convert_to_pc_address(self, addr):
-        #takes as input an address in the SNES address space and maps it to the correct address in the PC ROM.
+    def _compute_pc_address(self, addr):
+        #the long way to map an address in the SNES address space to the PC ROM.
+        #only used to build the tables that convert_to_pc_address() looks things up in
         if addr > 0xFFFFFF or addr < 0:
-            raise AssertionError(f"Function convert_to_pc_address() called on {hex(addr)}, but this is outside SNES address space.")
+            raise AssertionError(f"Function _compute_pc_address() called on {hex(addr)}, but this is outside SNES address space.")
         
         bank = addr // 0x10000
         offset = addr % 0x10000
@@ -237,15 +1011,15 @@ class RomHandler:
                 offset += 0x8000
             #Now check for the usual stuff
             if offset < 0x8000 or bank in [0x7E,0x7F]:
-                raise AssertionError(f"Function convert_to_pc_address() called on {hex(addr)}, but this does not map to ROM.")
+                raise AssertionError(f"Function _compute_pc_address() called on {hex(addr)}, but this does not map to ROM.")
             else:
                 pc_address = (bank % 0x80)*0x8000 + (offset - 0x8000)
                     
         elif self._type == RomType.HIROM:
             if bank in [0x7E, 0x7F] or (bank < 0xC0 and offset < 0x8000):
-                raise AssertionError(f"Function convert_to_pc_address() called on {hex(addr)}, but this does not map to ROM.")
+                raise AssertionError(f"Function _compute_pc_address() called on {hex(addr)}, but this does not map to ROM.")
             else:
-                pc_address = (bank // 0x40)*0x10000 + offset
+                pc_address = (bank % 0x40)*0x10000 + offset
 
         elif self._type == RomType.EXLOROM:
             #This particular part of address space has something to do with MAD-1 or lack thereof
@@ -257,25 +1031,25 @@ class RomHandler:
             elif bank not in [0x7E, 0x7F] and offset >= 0x8000:    #slowrom block
                 pc_address = (bank+0x80)*0x8000 + (offset-0x8000)
             else:
-                raise AssertionError(f"Function convert_to_pc_address() called on address {hex(addr)}, but this does not map to ROM.")
+                raise AssertionError(f"Function _compute_pc_address() called on address {hex(addr)}, but this does not map to ROM.")
         
         elif self._type == RomType.EXHIROM:
             if bank >= 0xC0:              #the fastrom block
                 pc_address = (bank - 0xC0)*0x10000 + offset
             elif bank >= 0x40 and bank < 0x7E:    #the slowrom block
                 pc_address = bank*0x10000 + offset
-            elif bank in [0x3E, 0x3F] and offset > 0x8000:    #the little bit of extra room at the end of the slowrom block
+            elif bank in [0x3E, 0x3F] and offset >= 0x8000:    #the little bit of extra room at the end of the slowrom block
                 pc_address = (bank + 0x40)*0x10000 + offset
             elif bank >= 0x80 and bank < 0xC0 and offset >= 0x8000:   #the fastrom mirror
                 pc_address = (bank - 0x80)*0x10000 + offset
             elif bank < 0x3E and offset >= 0x8000:  #the slowrom mirror
                 pc_address = (bank + 0x40)*0x10000 + offset
             else:
-                raise AssertionError(f"Function convert_to_pc_address() called on {hex(addr)}, but this does not map to ROM.")
+                raise AssertionError(f"Function _compute_pc_address() called on {hex(addr)}, but this does not map to ROM.")
         else:
-            raise NotImplementedError(f"Function convert_to_pc_address() called with not implemented type {self._type}")
+            raise NotImplementedError(f"Function _compute_pc_address() called with not implemented type {self._type}")
 
-        if pc_address > self._rom_size:
+        if pc_address >= self._rom_size:
             #the rom is not large enough to actually contain the indexed address, so we need to consider mirrored addresses 
             if self._type == RomType.LOROM or self._type == RomType.EXLOROM:
                 masked_addr = addr & 0x7FFFFF
@@ -284,11 +1058,45 @@ class RomHandler:
 
             most_significant_bit = masked_addr.bit_length() - 1
             new_addr = addr - (1 << most_significant_bit)
-            pc_address = self.convert_to_pc_address(new_addr)    #recurse to get the corrected address
+            pc_address = self._compute_pc_address(new_addr)    #recurse to get the corrected address
         
         return pc_address
 
 
+    def _build_bank_maps(self):
+        #every mapping we support is linear within each 0x8000 byte half bank, so the address conversions
+        # only need to know where each half bank starts.  -1 marks a half bank that does not map anywhere.
+        #the maps only depend on the type and size, so they are shared by every handler with the same ones
+        key = (self._type, self._rom_size)
+        bank_maps = _BANK_MAPS.get(key)
+        if bank_maps is None:
+            bank_maps = _BANK_MAPS[key] = self._compute_bank_maps()
+        self._pc_address_map, self._snes_address_map, self._pc_address_array, self._snes_address_array = bank_maps
+
+    def _compute_bank_maps(self):
+        pc_address_map = []
+        for half_bank in range(0x200):
+            try:
+                pc_address_map.append(self._compute_pc_address(half_bank << 15))
+            except AssertionError:
+                pc_address_map.append(-1)
+
+        #one extra entry so that the address right at the end of the ROM can still be converted
+        snes_address_map = []
+        for half_bank in range((self._rom_size >> 15) + 1):
+            try:
+                snes_address_map.append(self._compute_snes_address(half_bank << 15))
+            except AssertionError:
+                snes_address_map.append(-1)
+
+        #numpy copies for the batch conversions.  These are shared, so make sure nothing writes to them
+        pc_address_array = np.array(pc_address_map, dtype=np.int64)
+        snes_address_array = np.array(snes_address_map, dtype=np.int64)
+        pc_address_array.setflags(write=False)
+        snes_address_array.setflags(write=False)
+        return tuple(pc_address_map), tuple(snes_address_map), pc_address_array, snes_address_array
+
+
     def equivalent_addresses(self, addr1, addr2):
         #see if two addresses map to the same point in PC ROM
         return self.convert_to_pc_address(addr1) == self.convert_to_pc_address(addr2)
@@ -296,21 +1104,183 @@ class RomHandler:
 
     def expand(self,size):
         #expands the ROM upwards in size to the specified number of MBits.
-        #In this implementation, does not work to expand ROMs any higher than 32 MBits.
-        if size < 4 or size > 32 or size % 4 != 0:
-            raise NotImplementedError(f"Not Implemented to expand ROM to {size} MBits.  Must be a multiple of 4 between 4 and 32.")
+        #Up to 32 MBits, the ROM keeps its type.  Past that, it has to use one of the extended layouts, so LoROM becomes
+        # ExLoROM and HiROM becomes ExHiROM.  These look for the internal header (and the vectors) in the upper half of
+        # the ROM, so the bank that holds them is copied there, and the makeup byte is changed to match.
+        #Note that this copied bank is the only part of the old ROM that is still in banks $00-$3F afterwards (the old
+        # ROM is now at $80-$FF or $C0-$FF), so any code that runs from the other banks down there needs to be moved.
+        if size % 4 != 0 or not (4 <= size <= 32 or size in [48, 64]):
+            raise NotImplementedError(f"Not Implemented to expand ROM to {size} MBits.  Must be a multiple of 4 between 4 and 32, or else 48 or 64.")
         current_size = self._rom_size/self._MEGABIT
         if size <= current_size:
             #raise AssertionError(f"Received request to expand() to size {size} MBits, but the ROM is already {self._rom_size/self._MEGABIT} MBits")
             return None     #For now I am convinced that it is ok to just do nothing in this case instead of throwing an error
 
+        self._resize_contents(size*self._MEGABIT)  #actually extend the ROM by padding with zeros
+
+        if size > 32 and self._type in [RomType.LOROM, RomType.HIROM]:
+            if self._type == RomType.LOROM:
+                new_type, header_bank, makeup_byte = RomType.EXLOROM, 0x0000, 0x32
+            else:
+                new_type, header_bank, makeup_byte = RomType.EXHIROM, 0x8000, 0x35
+            self._mark_dirty(0x400000 + header_bank, 0x8000)
+            self._contents[0x400000+header_bank:0x408000+header_bank] = self._contents[header_bank:header_bank+0x8000]
+            self._type = new_type
+            self._build_bank_maps()
+            self._write_to_internal_header(0x15, makeup_byte, 1)
+
         size_code = 0x07 + (size-1).bit_length()   #this is a code for the internal header which specifies the approximate ROM size.
         self._write_to_internal_header(0x17, size_code, 1)
 
-        pad_byte_amount = size*self._MEGABIT-self._rom_size
-        self._contents.extend([0]*pad_byte_amount)  #actually extend the ROM by padding with zeros
 
-        self._rom_size = size*self._MEGABIT
+    def allocate(self, size, bank_aligned=False, region=None, fill=0x00):
+        #finds size bytes of unused space (a run of fill bytes, e.g. the padding left by expand()) and claims it, so that
+        # later calls will not hand it out again.  Returns (PC address, SNES address) of the start of the space.
+        #the space never crosses from one SNES bank into the next, unless it is bigger than a bank, in which case it
+        # starts at the beginning of one.  bank_aligned=True makes it start at the beginning of a bank regardless.
+        #region limits the search to a range of PC addresses, given as (start, end)
+        #
+        #the free space is found in one pass the first time, and after that only the pages that have been written to get
+        # looked at again.  Claimed space stays claimed even if it still holds fill bytes, so it is safe to claim several
+        # pieces before writing any of them.
+        if size <= 0:
+            raise AssertionError(f"allocate() called for {size} bytes")
+        region_start, region_end = (0, self._rom_size) if region is None else region
+        region_start, region_end = max(0, region_start), min(self._rom_size, region_end)
+
+        bank_size = 0x10000 if self._type in [RomType.HIROM, RomType.EXHIROM] else 0x8000
+        index = self._get_free_space_index(fill)
+        for run in range(bisect.bisect_right(index.ends, region_start), len(index.starts)):
+            if index.starts[run] >= region_end:
+                break
+            start, end = max(index.starts[run], region_start), min(index.ends[run], region_end)
+            while True:
+                if bank_aligned or size > bank_size or start//bank_size != (start+size-1)//bank_size:
+                    start = -(-start // bank_size) * bank_size      #move up to the next bank
+                if start + size > end:
+                    break
+                #padding can also be in half banks that the SNES cannot see (e.g. the top of a 64 MBit ExHiROM),
+                # so skip past any of those and try again
+                unmapped = [half_bank for half_bank in range(start >> 15, ((start+size-1) >> 15) + 1)
+                            if self._snes_address_map[half_bank] < 0]
+                if unmapped:
+                    start = (unmapped[-1] + 1) << 15
+                    continue
+                snes_address = self.convert_to_snes_address(start)
+                index.claim(start, start + size)
+                return start, snes_address
+
+        raise AssertionError(f"allocate() could not find {hex(size)} bytes of free space ({hex(fill)} fill)")
+
+    def find_free_space(self, fill=0x00):
+        #returns every run of unclaimed fill bytes (at least a few bytes long), as a list of (start, end) PC addresses
+        index = self._get_free_space_index(fill)
+        return list(zip(index.starts, index.ends))
+
+    def _get_free_space_index(self, fill):
+        if not 0 <= fill <= 0xFF:
+            raise AssertionError(f"fill must be a byte value, not {fill}")
+        self._catch_up_with_views()     #anything a writable view has written has to be looked at again
+        index = self._free_space_indexes.get(fill)
+        if index is None:
+            index = self._add_free_space_index(fill, _FreeSpaceIndex(self._contents, fill))
+        index.refresh(self._contents, self._PAGE_SIZE)
+        return index
+
+    def _add_free_space_index(self, fill, index):
+        self._free_space_indexes[fill] = index
+        self._write_listeners.append(index.stale_pages)
+        return index
+
+    def search(self, pattern):
+        #finds every place that pattern occurs in the ROM, and returns a list of (PC address, SNES address) for each,
+        # where the SNES address is None if that part of the ROM is not mapped.
+        #pattern can be bytes, a list of byte values with None as a wildcard, or a string of hex with ?? as a wildcard
+        #example: .search("A9 ?? 8D 00 21") finds every LDA #$xx : STA $2100
+        #
+        #the first search builds an index of the whole ROM, which makes the searches after it fast.  Writes after that
+        # are taken care of by searching the pages they touched directly.
+        values, mask = _parse_search_pattern(pattern)
+        length = len(values)
+        data = np.frombuffer(self._contents, dtype=np.uint8)
+        last_start = self._rom_size - length        #the last place that the pattern can start
+        if last_start < 0:
+            return []
+        gram_offsets = [offset for offset in range(length-2) if mask[offset:offset+3].all()]
+
+        if not gram_offsets:
+            #no 3 fixed bytes in a row, so check everywhere that the first fixed byte matches
+            first_fixed = int(np.flatnonzero(mask)[0])
+            candidates = np.flatnonzero(data[first_fixed:first_fixed+last_start+1] == values[first_fixed])
+        else:
+            #use the 3 fixed bytes in the pattern that occur the least often in the ROM
+            index = self._get_search_index()
+            best_offset = min(gram_offsets, key=lambda offset: index.count(_get_3_grams(values[offset:offset+3])[0]))
+            gram = _get_3_grams(values[best_offset:best_offset+3])[0]
+            candidates = index.lookup(gram).astype(np.int64)
+            if index.stale_pages:
+                #anything the index says about the written pages is out of date, so look through those pages directly
+                stale = np.zeros(self._rom_size//self._PAGE_SIZE, dtype=bool)
+                stale[list(index.stale_pages)] = True
+                candidates = candidates[~stale[candidates//self._PAGE_SIZE] & ~stale[(candidates+2)//self._PAGE_SIZE]]
+                candidates = [candidates]
+                for start, end in zip(*_find_runs(stale)):
+                    window_start = max(0, start*self._PAGE_SIZE - 2)
+                    window_grams = _get_3_grams(data[window_start:end*self._PAGE_SIZE + 2])
+                    candidates.append(np.flatnonzero(window_grams == gram) + window_start)
+                candidates = np.sort(np.concatenate(candidates))
+            candidates = candidates - best_offset
+            candidates = candidates[(candidates >= 0) & (candidates <= last_start)]
+
+        for offset in np.flatnonzero(mask).tolist():
+            if len(candidates) == 0:
+                break
+            candidates = candidates[data[candidates+offset] == values[offset]]
+        return self._with_snes_addresses(candidates)
+
+    def find_pointers(self, snes_address, size=3, mirrors=True):
+        #finds every little endian pointer to snes_address, and returns (PC address, SNES address) of each, like search().
+        #with mirrors=True, pointers to any other SNES address for the same byte of ROM count too (e.g. $00:8000 and $80:8000 in LoROM).
+        #size=2 finds 16 bit pointers, which do not say which bank they are for, so these can also be pointers to other banks
+        if size not in [2,3]:
+            raise AssertionError(f"find_pointers() called with size {size}, but pointers are 2 or 3 bytes")
+        targets = self._get_mirrored_snes_addresses(snes_address) if mirrors else [snes_address]
+        patterns = sorted(set((target & ((1 << 8*size) - 1)).to_bytes(size, "little") for target in targets))
+        hits = set()
+        for pattern in patterns:
+            hits.update(self.search(pattern))
+        return sorted(hits)
+
+    def _get_mirrored_snes_addresses(self, snes_address):
+        #every SNES address that maps to the same byte of ROM as snes_address
+        pc_address = self.convert_to_pc_address(snes_address)
+        half_banks = np.flatnonzero((self._pc_address_array >= 0) & (self._pc_address_array <= pc_address) &
+                                    (pc_address < self._pc_address_array + 0x8000))
+        return [(half_bank << 15) + pc_address - int(self._pc_address_array[half_bank]) for half_bank in half_banks.tolist()]
+
+    def _with_snes_addresses(self, pc_addresses):
+        pc_addresses = np.asarray(pc_addresses, dtype=np.int64)
+        snes_addresses = self._snes_address_array[pc_addresses >> 15]
+        snes_addresses = np.where(snes_addresses >= 0, snes_addresses + (pc_addresses & 0x7FFF), -1)
+        return [(pc_address, snes_address if snes_address >= 0 else None)
+                for pc_address, snes_address in zip(pc_addresses.tolist(), snes_addresses.tolist())]
+
+    def _get_search_index(self):
+        self._catch_up_with_views()     #anything a writable view has written has to be looked at again
+        index = self._search_index
+        #once enough has been written, searching the written pages directly costs more than indexing everything again
+        if index is None or len(index.stale_pages) > self._rom_size//self._PAGE_SIZE//16:
+            if index is not None:
+                self._write_listeners = [pages for pages in self._write_listeners if pages is not index.stale_pages]
+            index = self._search_index = _SearchIndex(self._contents)
+            self._write_listeners.append(index.stale_pages)
+        return index
+
+    def _forget_indexes(self):
+        #for when the ROM changes size, which the indexes cannot follow.  They get rebuilt when they are next needed
+        self._write_listeners = []
+        self._free_space_indexes = {}
+        self._search_index = None
 
 
     def type(self):
@@ -327,41 +1297,346 @@ class RomHandler:
     	self._rom_is_headered = False
 
 
+    def apply_ips(self, patch):
+        #applies an IPS patch (given as bytes) to the ROM.  The offsets in the patch are taken to be relative to the
+        # start of the ROM itself, i.e. not counting the copier header, which is how most patches are made nowadays.
+        patch = memoryview(patch)
+        if bytes(patch[:5]) != b"PATCH":
+            raise AssertionError("apply_ips() was not given an IPS patch")
+
+        records = []
+        new_size = self._rom_size
+        position = 5
+        while True:
+            if position+3 > len(patch):
+                raise AssertionError("apply_ips() was given a patch that ends before its EOF marker")
+            if bytes(patch[position:position+3]) == b"EOF":
+                position += 3
+                break
+            offset = int.from_bytes(patch[position:position+3], "big")
+            size = int.from_bytes(patch[position+3:position+5], "big")
+            position += 5
+            if size == 0:   #run length encoded record
+                size = int.from_bytes(patch[position:position+2], "big")
+                data = bytes(patch[position+2:position+3])*size
+                position += 3
+            else:
+                data = patch[position:position+size]
+                position += size
+            if len(data) != size:
+                raise AssertionError("apply_ips() was given a patch that ends in the middle of a record")
+            records.append((offset, data))
+            new_size = max(new_size, offset+size)
+
+        if len(patch) - position >= 3:   #the optional truncation extension
+            new_size = int.from_bytes(patch[position:position+3], "big")
+        elif new_size > self._rom_size:
+            new_size = -(-new_size // 0x8000) * 0x8000     #round growth up to a whole number of half banks
+        if new_size % 0x8000 != 0:
+            raise AssertionError(f"apply_ips() would leave the ROM at {hex(new_size)} bytes, which is not an even number of half banks")
+        if new_size != self._rom_size:
+            self._resize_contents(new_size)
+
+        for offset, data in records:
+            if offset < new_size:
+                data = data[:new_size-offset]
+                self._mark_dirty(offset, len(data))
+                self._contents[offset:offset+len(data)] = data
+
+    def create_ips(self, base):
+        #returns an IPS patch (as bytes) that turns the ROM in the handler base into this ROM
+        RECORD_OVERHEAD = 5     #so do not bother starting a new record for a gap shorter than this
+        old = np.frombuffer(base._contents, dtype=np.uint8)
+        new = np.frombuffer(self._contents, dtype=np.uint8)
+        common_size = min(len(old), len(new))
+        changed = old[:common_size] != new[:common_size]
+        if len(new) > common_size:
+            #growth is filled in with zeros when applied, but make sure that the last byte is in there so the size comes out right
+            grown = new[common_size:] != 0
+            grown[-1] = True
+            changed = np.concatenate((changed, grown))
+
+        patch = bytearray(b"PATCH")
+        for start, end in zip(*_find_runs(changed, RECORD_OVERHEAD)):
+            position = start
+            while position < end:
+                if position == _IPS_EOF_OFFSET:
+                    position -= 1    #back up a byte so that this record does not look like the end of the patch
+                size = min(end-position, 0xFFFF)
+                data = new[position:position+size]
+                patch += position.to_bytes(3, "big")
+                if size > 8 and (data == data[0]).all():
+                    patch += bytes([0, 0]) + size.to_bytes(2, "big") + bytes([data[0]])
+                else:
+                    patch += size.to_bytes(2, "big") + data.tobytes()
+                position += size
+        patch += b"EOF"
+        if len(new) < len(old):
+            patch += len(new).to_bytes(3, "big")
+        return bytes(patch)
+
+    def apply_bps(self, patch):
+        #applies a BPS patch (given as bytes) to the ROM, not counting the copier header.
+        #the CRC32s in the patch are checked against the patch itself, the ROM before patching, and the ROM after patching
+        patch = memoryview(patch)
+        if len(patch) < 16 or bytes(patch[:4]) != b"BPS1":
+            raise AssertionError("apply_bps() was not given a BPS patch")
+        source_crc, target_crc, patch_crc = struct.unpack("<LLL", patch[-12:])
+        if zlib.crc32(patch[:-4]) != patch_crc:
+            raise AssertionError("apply_bps() was given a patch that is corrupted (the patch CRC32 does not match)")
+
+        source_size, position = _decode_bps_number(patch, 4)
+        target_size, position = _decode_bps_number(patch, position)
+        metadata_size, position = _decode_bps_number(patch, position)
+        position += metadata_size
+        if source_size != self._rom_size or zlib.crc32(self._contents) != source_crc:
+            raise AssertionError("apply_bps() was given a patch that was not made for this ROM (the source CRC32 does not match)")
+
+        source = memoryview(self._contents)
+        target = bytearray(target_size)
+        output_offset = source_relative_offset = target_relative_offset = 0
+        actions_end = len(patch) - 12
+        while position < actions_end:
+            data, position = _decode_bps_number(patch, position)
+            command, length = data & 3, (data >> 2) + 1
+            if command == 0:    #source read
+                target[output_offset:output_offset+length] = source[output_offset:output_offset+length]
+            elif command == 1:  #target read
+                target[output_offset:output_offset+length] = patch[position:position+length]
+                position += length
+            elif command == 2:  #source copy
+                data, position = _decode_bps_number(patch, position)
+                source_relative_offset += -(data >> 1) if data & 1 else data >> 1
+                target[output_offset:output_offset+length] = source[source_relative_offset:source_relative_offset+length]
+                source_relative_offset += length
+            else:               #target copy, which is allowed to overlap the output it is copying from
+                data, position = _decode_bps_number(patch, position)
+                target_relative_offset += -(data >> 1) if data & 1 else data >> 1
+                distance = output_offset - target_relative_offset
+                if distance >= length:
+                    target[output_offset:output_offset+length] = target[target_relative_offset:target_relative_offset+length]
+                else:
+                    repeats = -(-length // distance)
+                    target[output_offset:output_offset+length] = (target[target_relative_offset:output_offset]*repeats)[:length]
+                target_relative_offset += length
+            output_offset += length
+        source.release()
+
+        if zlib.crc32(target) != target_crc:
+            raise AssertionError("apply_bps() produced a ROM that does not match the patch (the target CRC32 does not match)")
+        if target_size % 0x8000 != 0:
+            raise AssertionError(f"apply_bps() would leave the ROM at {hex(target_size)} bytes, which is not an even number of half banks")
+        if target_size != self._rom_size:
+            self._resize_contents(target_size)
+        self._replace_contents(target)
+
+    def create_bps(self, base):
+        #returns a BPS patch (as bytes) that turns the ROM in the handler base into this ROM.
+        #this mostly uses source reads and target reads, which is plenty for patches to the same game.  If the ROM has
+        # grown, the zeros that it grew by are filled in with target copies of a zero byte, as create_ips() leaves them out.
+        ACTION_OVERHEAD = 4     #unchanged stretches shorter than this are cheaper to just include in the patch
+        old = np.frombuffer(base._contents, dtype=np.uint8)
+        new = np.frombuffer(self._contents, dtype=np.uint8)
+        common_size = min(len(old), len(new))
+        changed = np.empty(len(new), dtype=bool)
+        changed[:common_size] = old[:common_size] != new[:common_size]
+        changed[common_size:] = new[common_size:] != 0
+
+        patch = bytearray(b"BPS1")
+        patch += _encode_bps_number(len(old)) + _encode_bps_number(len(new)) + _encode_bps_number(0)
+        output_offset = target_relative_offset = 0
+        for start, end in list(zip(*_find_runs(changed, ACTION_OVERHEAD))) + [(len(new), len(new))]:
+            #the unchanged stretch before this run comes from the source where there is one, and is zeros past that
+            source_end = min(start, common_size)
+            if source_end > output_offset:
+                patch += _encode_bps_number(((source_end-output_offset-1) << 2) | 0)
+                output_offset = source_end
+            if start > output_offset:
+                if output_offset == 0 or new[output_offset-1] != 0:
+                    patch += _encode_bps_number((0 << 2) | 1) + b"\x00"
+                    output_offset += 1
+                if start > output_offset:
+                    #a target copy that starts one byte back keeps repeating that byte
+                    relative_offset = output_offset - 1 - target_relative_offset
+                    patch += _encode_bps_number(((start-output_offset-1) << 2) | 3)
+                    patch += _encode_bps_number((abs(relative_offset) << 1) | (relative_offset < 0))
+                    target_relative_offset = start - 1
+                    output_offset = start
+            if end > start:
+                patch += _encode_bps_number(((end-start-1) << 2) | 1) + new[start:end].tobytes()
+                output_offset = end
+
+        patch += struct.pack("<LL", zlib.crc32(base._contents), zlib.crc32(self._contents))
+        patch += struct.pack("<L", zlib.crc32(patch))
+        return bytes(patch)
+
+
+    def fork(self):
+        #returns a new handler with the same ROM, for making variants of it without paying for a full copy each time.
+        #the contents are written once into an anonymous file, and each fork maps that file copy-on-write, so all the
+        # forks share the pages they have not touched and the operating system only copies the pages that get written.
+        #the fork and this handler are independent afterwards: changes to one are not seen by the other.
+        #while there is a writable view() of this handler, every fork has to write a new snapshot, since the view could
+        # have changed anything in its range
+        self._catch_up_with_views()
+        if self._fork_snapshot is None:
+            if hasattr(os, "memfd_create"):
+                snapshot = open(os.memfd_create("rom_snapshot"), "w+b")
+            else:
+                snapshot = tempfile.TemporaryFile()
+            snapshot.write(self._contents)
+            snapshot.flush()
+            self._fork_snapshot = snapshot
+
+        fork = copy.copy(self)
+        fork._mmap = mmap.mmap(self._fork_snapshot.fileno(), self._rom_size, access=mmap.ACCESS_COPY)
+        fork._mmap_mode = "c"
+        fork._source_filename = None
+        fork._fork_snapshot = None
+        fork._writable_views = []
+        fork._contents = memoryview(fork._mmap)
+        if self._rom_is_headered:
+            fork._header = bytearray(self._header)
+        fork._dirty_pages = dict(self._dirty_pages)
+        fork._remove_instrumentation()     #the copied wrappers would still be calling into this handler
+        fork._write_listeners = []
+        fork._free_space_indexes = {}
+        for fill, index in self._free_space_indexes.items():
+            fork._add_free_space_index(fill, index.copy())
+        fork._search_index = None
+        if self._search_index is not None:
+            fork._search_index = self._search_index.copy()
+            fork._write_listeners.append(fork._search_index.stale_pages)
+        return fork
+
+
+    def enable_instrumentation(self, stats=None):
+        #starts recording how this handler is used, and returns the AccessStats that it records into
+        # (a new one, unless stats is given, in which case several handlers can share it).
+        #the instrumented methods are wrapped on this handler only, so handlers without instrumentation pay nothing for it
+        self._remove_instrumentation()
+        self._access_stats = AccessStats() if stats is None else stats
+        for name, describe_access in _INSTRUMENTED_METHODS.items():
+            setattr(self, name, self._make_instrumented_method(name, describe_access))
+        return self._access_stats
+
+
+    def disable_instrumentation(self):
+        #stops recording, and returns what was recorded (or None if instrumentation was not enabled)
+        stats = self._access_stats
+        self._remove_instrumentation()
+        return stats
+
+
+    def close(self):
+        #releases the file mapping, if there is one.  The handler should not be used after this.
+        if self._mmap is not None:
+            self._contents.release()
+            self._mmap.close()
+            self._mmap = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def _make_instrumented_method(self, name, describe_access):
+        method = getattr(type(self), name)
+        stats = self._access_stats
+        def instrumented_method(*args, **kwargs):
+            outermost = stats._depth == 0
+            stats._depth += 1
+            start_time = time.perf_counter()
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                stats._depth -= 1
+                stats.seconds[name] += time.perf_counter() - start_time
+                stats.calls[name] += 1
+            if outermost and describe_access is not None:
+                stats._record_access(self, name, *describe_access(self, *args, **kwargs))
+            return result
+        instrumented_method.__name__ = name
+        instrumented_method.__doc__ = method.__doc__
+        return instrumented_method
+
+
+    def _remove_instrumentation(self):
+        for name in _INSTRUMENTED_METHODS:
+            self.__dict__.pop(name, None)
+        self._access_stats = None
+
+
+    def _detach_from_mmap(self):
+        #copies the mapped contents into memory and lets go of the mapping
+        contents = bytearray(self._contents)
+        self.close()
+        self._contents = contents
+
+
+    def _save_in_place(self, filename, patch=None):
+        content_start = self._HEADER_SIZE if self._rom_is_headered else 0
+        expected_size = content_start + self._rom_size
+        if not os.path.isfile(filename) or os.path.getsize(filename) != expected_size:
+            raise AssertionError(f"Cannot save in place to {filename}: expected an existing file of {hex(expected_size)} bytes")
+
+        #neighbouring dirty pages are written together, so there is one seek and one write per changed range
+        dirty = np.zeros(self._rom_size//self._PAGE_SIZE, dtype=bool)
+        dirty[list(self._dirty_pages)] = True
+        starts, ends = _find_runs(dirty)
+        with open(filename, "r+b") as file, memoryview(self._contents) as contents:
+            if self._rom_is_headered:
+                file.write(self._header)
+            for start, end in zip(starts, ends):
+                file.seek(content_start + start*self._PAGE_SIZE)
+                file.write(contents[start*self._PAGE_SIZE:end*self._PAGE_SIZE])
+            if patch is not None:
+                file.seek(content_start + patch[0])
+                file.write(patch[1])
+
+
+    def _save_atomically(self, filename, patch=None):
+        directory = os.path.dirname(os.path.abspath(filename))
+        temp_filename = os.path.join(directory, f".{os.path.basename(filename)}.{os.getpid()}.{os.urandom(4).hex()}.tmp")
+        try:
+            with open(temp_filename, "xb") as file:
+                self._write_image(file, patch)
+                file.flush()
+                os.fsync(file.fileno())
+            if os.path.isfile(filename):
+                os.chmod(temp_filename, os.stat(filename).st_mode & 0o7777)     #keep the permissions of the file being replaced
+            os.replace(temp_filename, filename)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+
+        #make the rename itself durable, where the platform allows syncing a directory
+        if hasattr(os, "O_DIRECTORY"):
+            directory_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
+
+
     def _read_single(self, addr, size):
-        if addr+size > self._rom_size:
+        plan = _get_encoding_plan(size)
+        if addr < 0 or addr+size > self._rom_size:
             raise AssertionError(f"function _read_single() called for address beyond ROM file boundary: : {hex(addr)}, size {size}")
-        extracted_bytes = self._contents[addr:addr+size]
-
-        if size == 1:
-            unpack_code = 'B'
-        elif size == 2:
-            unpack_code = 'H'
-        elif size == 3:
-            unpack_code = 'L'
-            extracted_bytes.append(0x00)    #no native 3-byte unpacking format in Python; this is a workaround to pad the 4th byte
-        elif size == 4:
-            unpack_code = 'L'
-        else:
-            raise NotImplementedError(f"_read_single() called to read size {size}, but this is not implemented.")
-
-        return struct.unpack('<'+unpack_code,extracted_bytes)[0]           #the '<' forces it to read as little-endian
+        return plan.unpack_from(self._contents, addr)[0]
 
 
     def _write_single(self, value, addr, size):
-        if addr+size > self._rom_size:
+        plan = _get_encoding_plan(size)
+        if addr < 0 or addr+size > self._rom_size:
             raise AssertionError(f"function _write_single() called for address beyond ROM file boundary: {hex(addr)}, size {size}")
-        if size == 1:
-            pack_code = 'B'
-        elif size == 2:
-            pack_code = 'H'
-        elif size == 3:
-            pack_code = 'L'
-        elif size == 4:
-            pack_code = 'L'
-        else:
-            raise NotImplementedError(f"_write_single() called to write size {size}, but this is not implemented.")
-
-        self._contents[addr:addr+size] = struct.pack('<'+pack_code,value)[0:size]  #the '<' forces it to write as little-endian
+        self._mark_dirty(addr, size)
+        plan.pack_into(self._contents, addr, (value,))
 
     def _apply_single_fix_to_snes_address(self, snes_address, classic_values, fixed_values, encoding):
         #checks to see if, indeed, a value is still in the classic (bugged) value, and if so, fixes it
@@ -378,6 +1653,50 @@ class RomHandler:
             return False
 
 
+    def _apply_fixes_to_snes_addresses(self, fixes):
+        #batch version of _apply_single_fix_to_snes_address().  fixes is a list of
+        # (snes_address, classic_values, fixed_values, encoding) tuples, and the addresses are all converted at once.
+        #returns a list with True for each fix that was applied and False otherwise
+        fixes = list(fixes)
+        if not fixes:
+            return []
+        pc_addresses = self.convert_to_pc_addresses([fix[0] for fix in fixes]).tolist()
+
+        #check every fix before writing any, so that a bad entry part way through cannot leave the ROM half patched
+        for pc_address, (snes_address, classic_values, fixed_values, encoding) in zip(pc_addresses, fixes):
+            self._check_fix(pc_address, snes_address, classic_values, fixed_values, encoding)
+
+        results = []
+        for pc_address, (snes_address, classic_values, fixed_values, encoding) in zip(pc_addresses, fixes):
+            if self.read(pc_address, encoding) == classic_values:
+                self.write(pc_address, fixed_values, encoding)
+                results.append(True)
+            else:
+                results.append(False)
+        return results
+
+
+    def _check_fix(self, pc_address, snes_address, classic_values, fixed_values, encoding):
+        #raises if the fix could not be read or written as given, without touching the ROM
+        if type(encoding) is int:
+            if type(fixed_values) is not int:
+                raise AssertionError(f"fix at {hex(snes_address)} has encoding {encoding} but {fixed_values} is not a single value")
+            fixed_values = [fixed_values]
+        elif type(encoding) is str:
+            if type(fixed_values) is int or len(classic_values) != len(fixed_values) or len(fixed_values) != len(encoding):
+                raise AssertionError(f"function _apply_fixes_to_snes_addresses() called with different length lists at {hex(snes_address)}:\n{classic_values}\n{fixed_values}")
+        else:
+            raise AssertionError(f"fix at {hex(snes_address)} has an encoding that was not recognized: {encoding}")
+
+        plan = _get_encoding_plan(encoding)
+        if pc_address < 0 or pc_address+plan.size > self._rom_size:
+            raise AssertionError(f"fix at {hex(snes_address)} is beyond ROM file boundary: {hex(pc_address)}, encoding {encoding}")
+        try:
+            plan.pack_into(bytearray(plan.size), 0, fixed_values)
+        except (struct.error, TypeError) as error:
+            raise AssertionError(f"fix at {hex(snes_address)} cannot encode {fixed_values} as {encoding}: {error}")
+
+
     def _read_from_internal_header(self, offset, size):
         return self.read_from_snes_address(offset + 0xFFC0, size)
 
@@ -387,31 +1706,133 @@ class RomHandler:
 
 
     def _fix_checksum(self):
-        #first write zero to the old checksum (for convenience, in case it was broken before)
-        self._write_to_internal_header(0x1C, [0xFFFF,0x0000], "22")
-        checksum = self._get_checksum()
-        self._write_to_internal_header(0x1C, [0xFFFF - checksum,checksum], "22")
-
-    def _get_checksum(self):
+        addr, data = self._get_checksum_fix()
+        self.bulk_write(addr, data, len(data))
+
+    def _get_checksum_fix(self):
+        #returns (PC address, bytes) of the checksum and its complement as they should be, without writing anything.
+        #the checksum is worked out as if the old ones were $FFFF and $0000 (for convenience, in case they were broken before)
+        addr = self.convert_to_pc_address(0xFFDC)
+        boundary, multiplier = self._get_checksum_layout()
+        weight = multiplier if addr >= boundary else 1
+        old_sum = sum(self._contents[addr:addr+4])
+        checksum = (self._get_checksum() + weight*(0xFF + 0xFF - old_sum)) % 0x10000
+        return addr, struct.pack("<HH", 0xFFFF - checksum, checksum)
+
+    def _get_checksum(self, full_recompute=False):
+        #the checksum is worked out once for the ROM as it was loaded, and after that it only needs to be adjusted
+        # by however much the changed pages have changed.  full_recompute=True ignores all that and sums everything,
+        # which is useful to verify the running value.
+        if full_recompute:
+            return self._weighted_sum() % 0x10000
+
+        if self._checksum_base is None:
+            self._checksum_base = self._weighted_sum() - self._dirty_pages_delta()
+        return (self._checksum_base + self._dirty_pages_delta()) % 0x10000
+
+    def _get_checksum_layout(self):
         #collected from a hodgepodge of data around the internet.  Hopefully all are correct.
+        #the checksum is the sum of all the bytes, except that everything from boundary onwards counts multiplier times
         mbit_size = self._rom_size//self._MEGABIT
 
         best_power_of_2 = 1 << mbit_size.bit_length()-1
         if best_power_of_2 == mbit_size:   #best case is that the MBits is a power of 2
-            checksum = sum(self._contents)
+            return self._rom_size, 1
         elif mbit_size == 28:              #special case that doesn't really fit well into the remaining formulas
-            checksum = sum(self._contents) + sum(self._contents[-4*self._MEGABIT:])
+            return self._rom_size-4*self._MEGABIT, 2
         else:                              #basic idea: repeat the part that's over a power of 2 until you get to the next multiple of 2
             lower_power_of_2 = 1 << (mbit_size-best_power_of_2).bit_length()-1
             if best_power_of_2 + lower_power_of_2 == mbit_size:
                 multiplier = best_power_of_2 // lower_power_of_2
-                checksum = sum(self._contents[:best_power_of_2*self._MEGABIT]) + \
-                                    multiplier*sum(self._contents[best_power_of_2*self._MEGABIT:])
+                return best_power_of_2*self._MEGABIT, multiplier
             else: #some strange MBit size maybe
                 raise AssertionError(f"Unable to process checksum for ROM of size {mbit_size} MBits")
 
-        return checksum % 0x10000
-
+    def _weighted_sum(self):
+        #the full (vectorized) sum behind the checksum, before it is cut down to 16 bits
+        boundary, multiplier = self._get_checksum_layout()
+        contents = np.frombuffer(self._contents, dtype=np.uint8)
+        total = int(contents.sum(dtype=np.uint64))
+        if multiplier != 1:
+            total += (multiplier-1)*int(contents[boundary:].sum(dtype=np.uint64))
+        return total
+
+    def _dirty_pages_delta(self):
+        #how much the weighted sum has changed since the ROM was loaded, looking only at the pages that were written to
+        boundary, multiplier = self._get_checksum_layout()
+        delta = 0
+        for page, original_sum in self._dirty_pages.items():
+            weight = multiplier if page*self._PAGE_SIZE >= boundary else 1
+            delta += weight*(self._get_page_sum(page) - original_sum)
+        return delta
+
+    def _get_page_sum(self, page):
+        start = page*self._PAGE_SIZE
+        return sum(self._contents[start:start+self._PAGE_SIZE])
+
+    def _mark_dirty(self, addr, size):
+        #call this before writing to the contents, so that the page can be remembered as it was before the change
+        if self._mmap_mode == "r":
+            raise AssertionError("Cannot write to a ROM that was opened with mmap_mode='r'")
+        self._fork_snapshot = None      #any forks made after this need to see the change
+        first_page = addr//self._PAGE_SIZE
+        last_page = (addr+size-1)//self._PAGE_SIZE
+        if first_page == last_page:     #by far the most common case, so skip the loop
+            if first_page not in self._dirty_pages:
+                self._dirty_pages[first_page] = self._get_page_sum(first_page)
+            for pages in self._write_listeners:
+                pages.add(first_page)
+            return
+        for page in range(first_page, last_page+1):
+            if page not in self._dirty_pages:
+                self._dirty_pages[page] = self._get_page_sum(page)
+        for pages in self._write_listeners:
+            pages.update(range(first_page, last_page+1))
+
+    def _catch_up_with_views(self):
+        #marks the range of every writable view() as written to again, since there is no telling what has been written
+        # through it since last time.  Views that have since gone away get this one last time, and are then forgotten
+        if not self._writable_views:
+            return
+        views = self._writable_views
+        self._writable_views = [view for view in views if view[0]() is not None]
+        for _, addr, num_bytes in views:
+            self._mark_dirty(addr, num_bytes)
+
+    def _resize_contents(self, new_size):
+        #grows (with zeros) or shrinks the ROM to exactly new_size bytes, without touching the internal header
+        self._catch_up_with_views()
+        if self._mmap is not None:
+            if self._mmap_mode == "r":
+                raise AssertionError("Cannot resize a ROM that was opened with mmap_mode='r'")
+            if new_size > self._rom_size:
+                #a mapping cannot grow, so move into memory, allocating the full new size at once instead of copying twice
+                contents = bytearray(new_size)
+                contents[:self._rom_size] = self._contents
+                self.close()
+                self._contents = contents
+            else:
+                self._detach_from_mmap()
+        if new_size > len(self._contents):
+            self._contents.extend(bytes(new_size-self._rom_size))
+        else:
+            del self._contents[new_size:]
+            last_page = (new_size-1)//self._PAGE_SIZE
+            self._dirty_pages = {page: original_sum for page, original_sum in self._dirty_pages.items() if page <= last_page}
+        self._rom_size = new_size
+        self._build_bank_maps()
+        self._checksum_base = None      #the checksum formula depends on the size, so this has to be worked out again
+        self._writable_views = []       #the contents could only be resized if there were none left
+        self._forget_indexes()
+
+    def _replace_contents(self, new_contents):
+        #overwrites the whole ROM with new_contents (which must be the same size), but only marks the pages that actually changed
+        old_pages = np.frombuffer(self._contents, dtype=np.uint8).reshape(-1, self._PAGE_SIZE)
+        new_pages = np.frombuffer(new_contents, dtype=np.uint8).reshape(-1, self._PAGE_SIZE)
+        for page in np.flatnonzero((old_pages != new_pages).any(axis=1)).tolist():
+            self._mark_dirty(page*self._PAGE_SIZE, self._PAGE_SIZE)
+        del old_pages
+        self._contents[:] = new_contents
 
         
 def main():
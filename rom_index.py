@@ -0,0 +1,85 @@
+#This file catalogs directories full of ROMs.  Each ROM is only probed (see rom.probe()), never read in full, and the
+# results are kept in a small JSON index so that the next run only has to probe the files that are new or have changed.
+
+import json
+import os
+
+from rom import probe, _ROM_EXTENSIONS
+
+#bump this if the entries change shape, so that old index files get rebuilt instead of misread
+_INDEX_VERSION = 1
+_DEFAULT_INDEX_FILENAME = ".rom_index.json"
+
+
+def index_directory(directory, index_filename=None, recursive=True, extensions=_ROM_EXTENSIONS):
+    #returns a dictionary that maps each ROM's path (relative to directory) to its entry, which is what probe() returns,
+    # except that the type is given by name (e.g. "LOROM") and mtime_ns is added.
+    #files that cannot be probed get an entry of {"file_size": ..., "mtime_ns": ..., "error": "..."} instead.
+    #
+    #the index is kept in index_filename (by default, a hidden file in directory).  An entry from there is reused as
+    # long as the file still has the same size and modification time; everything else is probed again.
+    if index_filename is None:
+        index_filename = os.path.join(directory, _DEFAULT_INDEX_FILENAME)
+    extensions = tuple(extension.lower() for extension in extensions)
+
+    old_entries = _load_index(index_filename)
+    entries = {}
+    for path in _find_roms(directory, recursive, extensions):
+        stat = os.stat(path)
+        relative_path = os.path.relpath(path, directory).replace(os.sep, "/")
+        entry = old_entries.get(relative_path)
+        if entry is None or entry["file_size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            entry = _probe_entry(path, stat)
+        entries[relative_path] = entry
+
+    if entries != old_entries:
+        _save_index(index_filename, entries)
+    return entries
+
+
+def _find_roms(directory, recursive, extensions):
+    for root, subdirectories, filenames in os.walk(directory):
+        if not recursive:
+            subdirectories.clear()
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extensions):
+                yield os.path.join(root, filename)
+
+
+def _probe_entry(path, stat):
+    try:
+        entry = probe(path)
+    except (AssertionError, OSError) as error:
+        return {"file_size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "error": str(error)}
+    entry["type"] = entry["type"].name
+    entry["mtime_ns"] = stat.st_mtime_ns
+    return entry
+
+
+def _load_index(index_filename):
+    #a missing, unreadable, or outdated index just means that everything gets probed again
+    try:
+        with open(index_filename, "r") as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(index, dict) or index.get("version") != _INDEX_VERSION:
+        return {}
+    return index.get("entries", {})
+
+
+def _save_index(index_filename, entries):
+    #written to a temporary file and renamed into place, so that an interrupted run cannot leave a broken index behind
+    temp_filename = f"{index_filename}.{os.getpid()}.tmp"
+    with open(temp_filename, "w") as file:
+        json.dump({"version": _INDEX_VERSION, "entries": entries}, file, separators=(",", ":"))
+    os.replace(temp_filename, index_filename)
+
+
+def main():
+    print(f"Called main() on utility library {__file__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+#This file runs RomHandler and util as a long-lived local service, so that tools which only need a few reads or one
+# render do not each pay for starting Python, importing numpy/PIL, and loading the ROM.
+#
+#  python service.py --unix /tmp/rom.sock                   #or: python service.py --port 8765
+#
+#requests and responses are single lines of JSON.  Every request has an "op", and may have an "id", which is copied into
+# the response so that a client can have several requests in flight on one connection.  For example:
+#  {"id": 1, "op": "read", "rom": "game.sfc", "reads": [[32736, 2], [32768, "1212"]], "snes": false}
+#     -> {"id": 1, "result": [2312, [1, 2, 3, 4]]}
+#  {"id": 2, "op": "translate", "rom": "game.sfc", "to": "pc", "addresses": [8421376]}
+#     -> {"id": 2, "result": [0]}
+#  {"id": 3, "op": "render", "tilemaps": [[0, 0, 0, 1, 0]], "DMA_writes": {"1": "00ff..."}, "palette": [0, 31, ...]}
+#     -> {"id": 3, "result": {"png": "<base64>", "origin": [0, 0]}}
+#  {"id": 4, "op": "render_sheet", "frames": [[[0, 0, 0, 1, 0]], [[0, 0, 0, 2, 0]]], "DMA_writes": {...}, "layout": "strip"}
+#     -> {"id": 4, "result": {"png": "<base64>", "rectangles": [[0, 0, 8, 8, [0, 0]], [9, 0, 8, 8, [0, 0]]]}}
+#  {"id": 5, "op": "stats"}
+#     -> {"id": 5, "result": {"latency": {"read": {"count": ..., "p50": ..., "p90": ..., "p99": ...}, ...}, "pool": {...}}}
+#anything that goes wrong comes back as {"id": ..., "error": "..."}
+
+import argparse
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import socket
+import time
+
+from rom import RomHandler
+
+#how many of the most recent latencies are kept for each op when working out percentiles
+_LATENCY_WINDOW = 10000
+#the longest request line that will be read.  asyncio's own default (64KB) is too small for big batches
+_MAX_REQUEST_SIZE = 64*1024*1024
+
+
+class _HandlerPool:
+    #a bounded, least-recently-used set of loaded ROMs.  ROMs are kept by the hash of their contents, so several paths
+    # to the same ROM share one handler, and a path is only read again when its size or modification time changes.
+    def __init__(self, max_handlers):
+        self._max_handlers = max_handlers
+        self._handlers = collections.OrderedDict()      #content hash -> RomHandler
+        self._paths = {}                                #real path -> ((size, mtime_ns), content hash)
+        self._loading = {}                              #real path -> future for a load that is already underway
+        self.hits = 0
+        self.loads = 0
+
+    async def get(self, path):
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        known = self._paths.get(path)
+        if known is not None and known[0] == signature and known[1] in self._handlers:
+            self.hits += 1
+            self._handlers.move_to_end(known[1])
+            return self._handlers[known[1]]
+
+        #only load each path once, even if several requests for it arrive while it is loading
+        if path not in self._loading:
+            self._loading[path] = asyncio.ensure_future(self._load(path, signature))
+        try:
+            return await asyncio.shield(self._loading[path])
+        finally:
+            self._loading.pop(path, None)
+
+    async def _load(self, path, signature):
+        contents = await asyncio.get_running_loop().run_in_executor(None, _read_file, path)
+        content_hash = hashlib.blake2b(contents, digest_size=16).hexdigest()
+        self._paths[path] = (signature, content_hash)
+        if content_hash not in self._handlers:
+            self.loads += 1
+            self._handlers[content_hash] = RomHandler.from_buffer(contents)
+            while len(self._handlers) > self._max_handlers:
+                self._handlers.popitem(last=False)
+        self._handlers.move_to_end(content_hash)
+        return self._handlers[content_hash]
+
+    def stats(self):
+        return {"handlers": len(self._handlers), "max_handlers": self._max_handlers, "hits": self.hits, "loads": self.loads}
+
+
+def _read_file(path):
+    with open(path, "rb") as file:
+        return bytearray(file.read())
+
+
+class _Latencies:
+    def __init__(self):
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=_LATENCY_WINDOW))
+        self._counts = collections.Counter()
+
+    def record(self, op, seconds):
+        self._samples[op].append(seconds)
+        self._counts[op] += 1
+
+    def summary(self):
+        #percentiles over the most recent requests, in milliseconds
+        summary = {}
+        for op, samples in self._samples.items():
+            ordered = sorted(samples)
+            summary[op] = {"count": self._counts[op]}
+            for percentile in [50, 90, 99]:
+                summary[op][f"p{percentile}"] = 1000*ordered[min(len(ordered)-1, len(ordered)*percentile//100)]
+        return summary
+
+
+class RomService:
+    def __init__(self, max_handlers=8, render_workers=None):
+        self._pool = _HandlerPool(max_handlers)
+        self._latencies = _Latencies()
+        self._render_workers = render_workers
+        self._render_executor = None
+        self._ops = {
+            "ping": self._ping,
+            "read": self._read,
+            "translate": self._translate,
+            "render": self._render,
+            "render_sheet": self._render_sheet,
+            "stats": self._stats,
+        }
+
+    async def serve(self, unix_path=None, host="127.0.0.1", port=8765):
+        #runs until cancelled.  Serves on a Unix socket if unix_path is given, otherwise on host:port
+        self._render_executor = concurrent.futures.ProcessPoolExecutor(self._render_workers)
+        try:
+            if unix_path is not None:
+                server = await asyncio.start_unix_server(self._handle_connection, path=unix_path, limit=_MAX_REQUEST_SIZE)
+            else:
+                server = await asyncio.start_server(self._handle_connection, host, port, limit=_MAX_REQUEST_SIZE)
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._render_executor.shutdown(cancel_futures=True)
+            if unix_path is not None and os.path.exists(unix_path):
+                os.remove(unix_path)
+
+    async def handle(self, request):
+        #answers one request (already decoded from JSON) and returns the response
+        start_time = time.perf_counter()
+        op = request.get("op")
+        response = {"id": request.get("id")}
+        try:
+            if op not in self._ops:
+                raise AssertionError(f"Unknown op {op}, expected one of {sorted(self._ops)}")
+            response["result"] = await self._ops[op](request)
+        except Exception as error:
+            response["error"] = f"{type(error).__name__}: {error}"
+        if op in self._ops:
+            self._latencies.record(op, time.perf_counter() - start_time)
+        return response
+
+    async def _handle_connection(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as error:
+                    line = error.partial        #the last request does not have to end in a newline
+                except asyncio.LimitOverrunError:
+                    #too long to answer, but the connection can carry on with the request after it
+                    await self._send(writer, {"id": None, "error": f"Request is longer than {_MAX_REQUEST_SIZE} bytes"})
+                    if not await _skip_line(reader):
+                        break
+                    continue
+                if not line:
+                    break
+                task = asyncio.ensure_future(self._answer_line(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def _answer_line(self, line, writer):
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            response = {"id": None, "error": f"Could not decode request: {error}"}
+        else:
+            response = await self.handle(request)
+        await self._send(writer, response)
+
+    async def _send(self, writer, response):
+        writer.write(json.dumps(response, separators=(",", ":")).encode() + b"\n")
+        await writer.drain()
+
+    async def _ping(self, request):
+        return "pong"
+
+    async def _read(self, request):
+        #reads is a list of [address, encoding], each answered as RomHandler.read() would (or read_from_snes_address()
+        # if snes is true).  An entry of [address, encoding, count] (or [address, encoding, count, stride]) is a read_many()
+        rom = await self._pool.get(request["rom"])
+        snes = request.get("snes", False)
+        results = []
+        for address, encoding, *table in request["reads"]:
+            if snes:
+                address = rom.convert_to_pc_address(address)
+            if table:
+                results.append(rom.read_many(address, encoding, *table))
+            else:
+                results.append(rom.read(address, encoding))
+        return results
+
+    async def _translate(self, request):
+        rom = await self._pool.get(request["rom"])
+        if request["to"] == "pc":
+            return rom.convert_to_pc_addresses(request["addresses"]).tolist()
+        elif request["to"] == "snes":
+            return rom.convert_to_snes_addresses(request["addresses"]).tolist()
+        raise AssertionError(f"translate needs 'to' to be 'pc' or 'snes', not {request['to']}")
+
+    async def _render(self, request):
+        #the compositing runs in a worker process, so that big renders do not hold up everything else
+        png, origin = await asyncio.get_running_loop().run_in_executor(
+            self._render_executor, _render_png, request["tilemaps"], _decode_DMA_writes(request), request.get("palette"))
+        return {"png": _encode_png(png), "origin": list(origin)}
+
+    async def _render_sheet(self, request):
+        #many frames in one go, laid out as in util.render_sheet().  Each tile is only decoded once for the whole batch
+        png, rectangles = await asyncio.get_running_loop().run_in_executor(
+            self._render_executor, _render_sheet_png, request["frames"], _decode_DMA_writes(request), request.get("palette"),
+            request.get("layout", "atlas"), request.get("padding", 1), request.get("max_width", 1024))
+        return {"png": _encode_png(png), "rectangles": rectangles}
+
+    async def _stats(self, request):
+        return {"latency": self._latencies.summary(), "pool": self._pool.stats()}
+
+
+async def _skip_line(reader):
+    #throws away the rest of a line that was too long to read.  Returns False if the connection closed first
+    while True:
+        try:
+            await reader.readuntil(b"\n")
+            return True
+        except asyncio.LimitOverrunError as error:
+            await reader.readexactly(error.consumed)
+        except asyncio.IncompleteReadError:
+            return False
+
+
+def _decode_DMA_writes(request):
+    #the DMA writes come as {index: hex string or list of bytes}, with the indices as strings since this is JSON
+    return {int(index, 0): bytes.fromhex(data) if isinstance(data, str) else bytes(data)
+            for index, data in request["DMA_writes"].items()}
+
+
+def _encode_png(png):
+    return None if png is None else base64.b64encode(png).decode("ascii")
+
+
+def _render_png(tilemaps, DMA_writes, palette):
+    #runs in a render worker.  util is imported here so that only the workers pay for PIL
+    import util
+    image, origin = util.render_frame(tilemaps, DMA_writes, palette)
+    if image is None:
+        return None, origin
+    png = io.BytesIO()
+    image.save(png, format="PNG")
+    return png.getvalue(), origin
+
+
+def _render_sheet_png(frames, DMA_writes, palette, layout, padding, max_width):
+    #runs in a render worker, like _render_png()
+    import util
+    image, rectangles = util.render_sheet(frames, DMA_writes, palette, layout, padding, max_width)
+    #as plain ints, since some of these come out of numpy
+    json_rectangles = []
+    for rectangle in rectangles:
+        if rectangle is None:
+            json_rectangles.append(None)
+        else:
+            x, y, width, height, origin = rectangle
+            json_rectangles.append([int(x), int(y), int(width), int(height), [int(origin[0]), int(origin[1])]])
+    rectangles = json_rectangles
+    if image is None:
+        return None, rectangles
+    png = io.BytesIO()
+    image.save(png, format="PNG")
+    return png.getvalue(), rectangles
+
+
+class ServiceClient:
+    #a small blocking client, for tools that just want to ask the service something:
+    #  with ServiceClient(unix_path="/tmp/rom.sock") as client:
+    #      values = client.request("read", rom="game.sfc", reads=[[0x7FDC, 2]])
+    def __init__(self, unix_path=None, host="127.0.0.1", port=8765):
+        if unix_path is not None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(unix_path)
+        else:
+            self._socket = socket.create_connection((host, port))
+        self._file = self._socket.makefile("rwb")
+        self._next_id = 0
+
+    def request(self, op, **arguments):
+        #sends one request and waits for its answer.  Raises AssertionError if the service reports an error
+        self._next_id += 1
+        self._file.write(json.dumps({"id": self._next_id, "op": op, **arguments}).encode() + b"\n")
+        self._file.flush()
+        response = json.loads(self._file.readline())
+        if "error" in response:
+            raise AssertionError(f"The service could not answer {op}: {response['error']}")
+        return response["result"]
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve ROM reads, address translation, and renders")
+    parser.add_argument("--unix", help="listen on this Unix socket instead of on a TCP port")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-handlers", type=int, default=8, help="how many ROMs to keep loaded")
+    parser.add_argument("--render-workers", type=int, default=None, help="processes for rendering (defaults to the number of cores)")
+    args = parser.parse_args()
+
+    service = RomService(args.max_handlers, args.render_workers)
+    try:
+        asyncio.run(service.serve(args.unix, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
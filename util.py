@@ -1,6 +1,9 @@
 #a collection of functions that are commonly needed for SNES files
 from PIL import Image
 import numpy as np
+import collections
+import hashlib
+import multiprocessing
 
 def get_bit(byteval,idx):
     #https://stackoverflow.com/questions/2591483/getting-a-specific-bit-value-in-a-byte-string
@@ -14,13 +17,249 @@ def convert_byte_to_signed_int(byte):
     else:
         return byte
 
+class GraphicsCache:
+    #a least-recently-used cache for decoded graphics, which holds at most max_bytes worth of arrays.
+    #the keys are hashes of the raw data that went into each entry, so the same graphics are shared no matter which
+    # ROM (or which RomHandler) they came from
+    def __init__(self, max_bytes=64*1024*1024):
+        self._entries = collections.OrderedDict()     #key -> (value, size in bytes), oldest first
+        self._max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        #returns the cached value, or None if there is nothing cached under this key
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, size):
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key)[1]
+        if size <= self._max_bytes:
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            self._evict()
+        return value
+
+    def set_max_bytes(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                "bytes": self.current_bytes, "max_bytes": self._max_bytes}
+
+    def _evict(self):
+        while self.current_bytes > self._max_bytes:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.current_bytes -= size
+
+#the cache that the functions in this file use unless they are told otherwise
+graphics_cache = GraphicsCache()
+
+def _content_key(kind, *parts):
+    #hashes a number of bytes-like parts (including numpy arrays) into a cache key
+    hasher = hashlib.blake2b(kind.encode(), digest_size=16)
+    for part in parts:
+        part = memoryview(part)
+        hasher.update(part.nbytes.to_bytes(8, "little"))
+        hasher.update(part)
+    return hasher.digest()
+
 def image_from_raw_data(tilemaps, DMA_writes):
     #expects:
     #  a list of tilemaps in the 5 byte format: essentially [X position, size+Xmsb, Y, index, palette]
     #  a dictionary consisting of writes to the DMA and what should be there
+    return render_frame(tilemaps, DMA_writes)
+
+def render_frame(tilemaps, DMA_writes, palette=None, cache=graphics_cache):
+    #same as image_from_raw_data(), but if a palette is given then it is applied as in apply_palette().
+    #frames and tiles are looked up in (and added to) cache, unless cache is None
+    pixels, origin = _render_frame_pixels(tilemaps, DMA_writes, palette, cache)
+    if pixels is None:
+        return None, origin
+    elif palette is None:
+        return _image_from_pixels(pixels), origin
+    else:
+        return Image.fromarray(pixels), origin
+
+def decode_tiles(raw_tiles, bpp=4, cache=graphics_cache):
+    #same as convert_tiles_from_bitplanes(), but remembers what it decoded.  Good for whole graphics banks,
+    # e.g. decode_tiles(rom.view(address, size)).  The array that comes back is read-only.
+    raw_tiles = _as_byte_array(raw_tiles)
+    if cache is None:
+        return convert_tiles_from_bitplanes(raw_tiles, bpp)
+    key = _content_key(f"tiles{bpp}", np.ascontiguousarray(raw_tiles))
+    tiles = cache.get(key)
+    if tiles is None:
+        tiles = convert_tiles_from_bitplanes(raw_tiles, bpp)
+        tiles.flags.writeable = False
+        cache.put(key, tiles, tiles.nbytes)
+    return tiles
+
+def _render_frame_pixels(tilemaps, DMA_writes, palette, cache):
+    #returns the composited frame as an array (palette indices, or RGBA if a palette is given) and its origin
+    needed_indices = _get_needed_tile_indices(tilemaps)
+    raw_tiles = [_as_byte_array(DMA_writes[index]) for index in needed_indices]
+
+    if cache is not None:
+        key_parts = [np.asarray(tilemaps, dtype=np.int64), np.asarray(needed_indices, dtype=np.int64)]
+        key_parts.extend(np.ascontiguousarray(raw_tile) for raw_tile in raw_tiles)
+        if palette is None:
+            key = _content_key("frame", *key_parts)
+        else:
+            key = _content_key("paletted frame", np.asarray(palette, dtype=np.int64), *key_parts)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    decoded_tiles = _decode_tiles_for_tilemaps(needed_indices, raw_tiles, cache)
+    pixels, origin = _composite_frame(tilemaps, decoded_tiles)
+    if pixels is not None and palette is not None:
+        pixels = apply_palette_to_array(pixels, palette)
+
+    if cache is not None:
+        if pixels is not None:
+            pixels.flags.writeable = False
+        cache.put(key, (pixels, origin), 64 if pixels is None else pixels.nbytes)
+    return pixels, origin
+
+def _get_needed_tile_indices(tilemaps):
+    #every tile index that the tilemaps will draw, in order
+    needed_indices = set()
+    for tilemap in tilemaps:
+        if tilemap[1] & 0xC2 == 0xC2:
+            needed_indices.update([tilemap[3], tilemap[3]+0x01, tilemap[3]+0x10, tilemap[3]+0x11])
+        else:
+            needed_indices.add(tilemap[3])
+    return sorted(needed_indices)
+
+def _decode_tiles_for_tilemaps(needed_indices, raw_tiles, cache=None):
+    #decodes the raw tiles for the given indices and returns them as a dictionary by index.
+    #anything that is not already in the cache gets decoded in one go
+    decoded_tiles = {}
+    missing = []
+    for index, raw_tile in zip(needed_indices, raw_tiles):
+        if cache is not None:
+            key = _content_key("tile", np.ascontiguousarray(raw_tile))
+            tile = cache.get(key)
+            if tile is not None:
+                decoded_tiles[index] = tile
+                continue
+        missing.append((index, raw_tile))
+
+    if missing:
+        for (index, raw_tile), tile in zip(missing, convert_tiles_from_bitplanes(np.stack([raw_tile for _, raw_tile in missing]))):
+            tile = tile.copy()      #so that each cached tile does not hold on to the whole batch
+            tile.flags.writeable = False
+            decoded_tiles[index] = tile
+            if cache is not None:
+                cache.put(_content_key("tile", np.ascontiguousarray(raw_tile)), tile, tile.nbytes)
+    return decoded_tiles
+
+def render_sheet(frames, DMA_writes, palette=None, layout="atlas", padding=1, max_width=1024, processes=1, cache=graphics_cache):
+    #same as render_sheet_array(), but returns an image: "P" mode, or RGBA if there is a palette
+    pixels, rectangles = render_sheet_array(frames, DMA_writes, palette, layout, padding, max_width, processes, cache)
+    if pixels.size == 0:        #nothing was drawn at all
+        return None, rectangles
+    elif palette is None:
+        return _image_from_pixels(pixels), rectangles
+    return Image.fromarray(pixels), rectangles
+
+def render_sheet_array(frames, DMA_writes, palette=None, layout="atlas", padding=1, max_width=1024, processes=1, cache=graphics_cache):
+    #renders many frames at once, e.g. a character's whole set of animations.  frames is a list of tilemap lists (as in
+    # image_from_raw_data()) that all draw from the same DMA_writes, and every tile they use is only decoded once.
+    #layout can be:
+    #  "atlas" -- the frames are packed into rows, tallest first, in a sheet no wider than max_width (unless one frame is)
+    #  "strip" -- the frames go left to right in equal cells, lined up by their origins, so they play as an animation
+    #the result is an array indexed [y][x], of palette indices (0 is transparent), or of RGBA if there is a palette,
+    # along with one rectangle per frame: (x, y, width, height, origin within the rectangle).  In an atlas, frames that
+    # do not draw anything have None instead.
+    #processes > 1 spreads the compositing over that many worker processes, which only pays off for big batches
+    if layout not in ["atlas", "strip"]:
+        raise AssertionError(f"render_sheet_array() called with layout {layout}, which should be 'atlas' or 'strip'")
+    frames = [list(tilemaps) for tilemaps in frames]
+
+    needed_indices = sorted(set().union(*(_get_needed_tile_indices(tilemaps) for tilemaps in frames)))
+    decoded_tiles = _decode_tiles_for_tilemaps(needed_indices, [_as_byte_array(DMA_writes[index]) for index in needed_indices], cache)
+
+    if processes > 1 and len(frames) > 1:
+        chunk_size = -(-len(frames) // processes)
+        chunks = [(frames[start:start+chunk_size], decoded_tiles) for start in range(0, len(frames), chunk_size)]
+        with multiprocessing.Pool(min(processes, len(chunks))) as pool:
+            rendered = [frame for chunk in pool.map(_composite_frames, chunks) for frame in chunk]
+    else:
+        rendered = _composite_frames((frames, decoded_tiles))
 
-    canvas = {}
-
+    if layout == "strip":
+        sheet, rectangles = _lay_out_strip(rendered, padding)
+    else:
+        sheet, rectangles = _lay_out_atlas(rendered, padding, max_width)
+    if palette is not None:
+        sheet = apply_palette_to_array(sheet, palette)
+    return sheet, rectangles
+
+def _composite_frames(job):
+    #this is what each worker process does for render_sheet_array()
+    frames, decoded_tiles = job
+    return [_composite_frame(tilemaps, decoded_tiles) for tilemaps in frames]
+
+def _lay_out_atlas(rendered, padding, max_width):
+    #simple shelf packing: tallest frames first, left to right, starting a new row whenever the next one does not fit
+    rectangles = [None]*len(rendered)
+    order = sorted((frame for frame in range(len(rendered)) if rendered[frame][0] is not None),
+                   key=lambda frame: -rendered[frame][0].shape[0])
+    x = y = row_height = sheet_width = 0
+    for frame in order:
+        height, width = rendered[frame][0].shape
+        if x > 0 and x + width > max_width:
+            x, y, row_height = 0, y + row_height + padding, 0
+        rectangles[frame] = (x, y, width, height, rendered[frame][1])
+        x += width + padding
+        row_height = max(row_height, height)
+        sheet_width = max(sheet_width, x - padding)
+
+    sheet = np.zeros((y + row_height, sheet_width), dtype=np.uint8)
+    for frame in order:
+        x, y, width, height, _ = rectangles[frame]
+        sheet[y:y+height, x:x+width] = rendered[frame][0]
+    return sheet, rectangles
+
+def _lay_out_strip(rendered, padding):
+    #every cell is big enough for every frame once they are lined up by origin
+    drawn = [(pixels, origin) for pixels, origin in rendered if pixels is not None]
+    left = max([origin[0] for _, origin in drawn], default=0)
+    top = max([origin[1] for _, origin in drawn], default=0)
+    right = max([pixels.shape[1] - origin[0] for pixels, origin in drawn], default=1)
+    bottom = max([pixels.shape[0] - origin[1] for pixels, origin in drawn], default=1)
+    cell_width, cell_height = left + right, top + bottom
+
+    sheet = np.zeros((cell_height, max(0, len(rendered)*(cell_width + padding) - padding)), dtype=np.uint8)
+    rectangles = []
+    for frame, (pixels, origin) in enumerate(rendered):
+        cell_x = frame*(cell_width + padding)
+        rectangles.append((cell_x, 0, cell_width, cell_height, (left, top)))
+        if pixels is not None:
+            x, y = cell_x + left - origin[0], top - origin[1]
+            sheet[y:y+pixels.shape[0], x:x+pixels.shape[1]] = pixels
+    return sheet, rectangles
+
+def _get_tile_placements(tilemaps):
+    #breaks the tilemaps down into the 8x8 tiles that need to be drawn, in the order that they should be drawn in.
+    #each placement is (x_offset, y_offset, tile index, h_flip, v_flip, palette_offset)
+    placements = []
     for tilemap in tilemaps:
         #tilemap[0] and the 0th bit of tilemap[1] encode the X offset
         x_offset = tilemap[0] - (0x100 if get_bit(tilemap[1],0) else 0)
@@ -35,64 +274,89 @@ def image_from_raw_data(tilemaps, DMA_writes):
         index = tilemap[3]
 
         #tilemap[4] contains palette info, priority info, and flip info
-        v_flip = get_bit(tilemap[4], 7) == 1
-        h_flip = get_bit(tilemap[4], 6) == 1
-        priority = get_bit(tilemap[4], 5) == 1              #TODO: implement a priority system
+        v_flip = get_bit(tilemap[4], 7)
+        h_flip = get_bit(tilemap[4], 6)
+        priority = (tilemap[4] >> 4) & 0b11                 #higher priority tiles get drawn on top of lower ones
         palette_offset = (tilemap[4] << 3) & 0b1110000      #this is shifted over so that it can be added to the index value to make a (less than) 8-bit value for "P" mode
 
-        def draw_tile_to_canvas(new_x_offset, new_y_offset, new_index):
-            tile_to_write = convert_tile_from_bitplanes(DMA_writes[new_index])
-            if h_flip:
-               tile_to_write = np.flipud(tile_to_write)
-            if v_flip:
-               tile_to_write = np.fliplr(tile_to_write)
-            for (i,j), value in np.ndenumerate(tile_to_write):
-                if value != 0:   #if not transparent
-                    canvas[(new_x_offset+i,new_y_offset+j)] = int(palette_offset + value)
-
         if big_tile:   #draw all four 8x8 tiles
-            draw_tile_to_canvas(x_offset+(8 if h_flip else 0),y_offset+(8 if v_flip else 0),index       )
-            draw_tile_to_canvas(x_offset+(0 if h_flip else 8),y_offset+(8 if v_flip else 0),index + 0x01)
-            draw_tile_to_canvas(x_offset+(8 if h_flip else 0),y_offset+(0 if v_flip else 8),index + 0x10)
-            draw_tile_to_canvas(x_offset+(0 if h_flip else 8),y_offset+(0 if v_flip else 8),index + 0x11)
+            placements.append((priority, x_offset+(8 if h_flip else 0),y_offset+(8 if v_flip else 0),index       , h_flip, v_flip, palette_offset))
+            placements.append((priority, x_offset+(0 if h_flip else 8),y_offset+(8 if v_flip else 0),index + 0x01, h_flip, v_flip, palette_offset))
+            placements.append((priority, x_offset+(8 if h_flip else 0),y_offset+(0 if v_flip else 8),index + 0x10, h_flip, v_flip, palette_offset))
+            placements.append((priority, x_offset+(0 if h_flip else 8),y_offset+(0 if v_flip else 8),index + 0x11, h_flip, v_flip, palette_offset))
         else:
-            draw_tile_to_canvas(x_offset,y_offset,index)
-
-    return to_image(canvas)
-
-
-
+            placements.append((priority, x_offset, y_offset, index, h_flip, v_flip, palette_offset))
+
+    #within the same priority, later tiles still get drawn over earlier ones (the sort is stable)
+    placements.sort(key=lambda placement: placement[0])
+    return [placement[1:] for placement in placements]
+
+def _composite_frame(tilemaps, decoded_tiles):
+    #draws the tilemaps into a numpy array of palette indices, indexed [y][x], where 0 is transparent.
+    #returns the array and the position of the origin within it, cropped the same way that to_image() would crop it,
+    # or (None, (0,0)) if nothing is drawn
+    placements = _get_tile_placements(tilemaps)
+    if not placements:
+        return None, (0,0)
+
+    #make the canvas big enough for every tile and for the origin
+    x_min = min(0, min(placement[0] for placement in placements))
+    y_min = min(0, min(placement[1] for placement in placements))
+    x_max = max(1, max(placement[0] for placement in placements) + 8)
+    y_max = max(1, max(placement[1] for placement in placements) + 8)
+    canvas = np.zeros((y_max-y_min, x_max-x_min), dtype=np.uint8)
+
+    for x_offset, y_offset, index, h_flip, v_flip, palette_offset in placements:
+        tile = decoded_tiles[index].T       #the decoded tiles are [x][y]
+        if h_flip:
+            tile = tile[:, ::-1]
+        if v_flip:
+            tile = tile[::-1, :]
+        x, y = x_offset-x_min, y_offset-y_min
+        region = canvas[y:y+8, x:x+8]
+        opaque = tile != 0
+        region[opaque] = tile[opaque] + palette_offset
+
+    return _crop_to_contents(canvas, (-x_min, -y_min))
+
+def _crop_to_contents(canvas, origin):
+    #crops an array of palette indices down to the pixels that are not transparent, but always keeps the origin in frame
+    rows = np.flatnonzero(canvas.any(axis=1))
+    columns = np.flatnonzero(canvas.any(axis=0))
+    if len(rows) == 0:
+        return None, (0,0)
+    top = min(rows[0], origin[1])
+    bottom = max(rows[-1], origin[1]) + 1
+    left = min(columns[0], origin[0])
+    right = max(columns[-1], origin[0]) + 1
+    return canvas[top:bottom, left:right], (int(origin[0]-left), int(origin[1]-top))
+
+def _image_from_pixels(pixels):
+    #makes a "P" mode image out of a numpy array of palette indices, indexed [y][x]
+    if pixels is None:
+        return None
+    height, width = pixels.shape
+    return Image.frombytes("P", (width, height), np.ascontiguousarray(pixels, dtype=np.uint8).tobytes())
 
 
 def to_image(canvas, zoom=1):
-
+    #expects a dictionary of palette indices, keyed by (x,y)
     if canvas.keys():
-        x_min = min([x for (x,y) in canvas.keys()])
-        x_max = max([x for (x,y) in canvas.keys()])
-        y_min = min([y for (x,y) in canvas.keys()])
-        y_max = max([y for (x,y) in canvas.keys()])
-
-        x_min = min(0,x_min)
-        x_max = max(0,x_max)
-        y_min = min(0,y_min)
-        y_max = max(0,y_max)
+        coordinates = np.array(list(canvas.keys()), dtype=np.int64).reshape(-1,2)
+        values = np.array(list(canvas.values()), dtype=np.uint8)
 
-        width = x_max-x_min+1
-        height = y_max-y_min+1
-        origin = (-x_min,-y_min)
+        x_min = min(0,coordinates[:,0].min())
+        x_max = max(0,coordinates[:,0].max())
+        y_min = min(0,coordinates[:,1].min())
+        y_max = max(0,coordinates[:,1].max())
 
-        image = Image.new("P", (width, height), 0)
+        width = int(x_max-x_min+1)
+        height = int(y_max-y_min+1)
+        origin = (int(-x_min),int(-y_min))
 
-        pixels = image.load()
-
-        #these next few lines add pink axis lines in case you're into that
-        # for i in range(x_min,x_max+1):
-        #     pixels[i+origin[0],origin[1]] = (0xFF,0x80,0xFF)    
-        # for j in range(y_min,y_max+1):
-        #     pixels[origin[0],j+origin[1]] = (0xFF,0x80,0xFF)
-
-        for (i,j),value in canvas.items():
-            pixels[i+origin[0],j+origin[1]] = value
+        pixels = np.zeros((height, width), dtype=np.uint8)
+        pixels[coordinates[:,1]-y_min, coordinates[:,0]-x_min] = values
+        image = _image_from_pixels(pixels)
 
         #scale
         if zoom != 1:
@@ -105,51 +369,94 @@ def to_image(canvas, zoom=1):
     return image, origin
 
 def apply_palette(image, palette):
-    flat_palette = [x for color in convert_to_rgb(palette) for x in color]
-    alpha_mask = image.convert('L').point(lambda x: 0 if x==0 else 255)
-    image.putpalette(flat_palette)                                          #apply palette
-    image = image.convert('RGBA')     #even though the Pillow documentation says it does this automatically, it doesn't.
-    image.putalpha(alpha_mask)        #make background transparent
-
+    #colors a "P" mode image of palette indices with the given 555 palette, and makes index 0 transparent
+    return Image.fromarray(apply_palette_to_array(np.asarray(image), palette))
+
+def apply_palette_to_array(pixels, palette):
+    #expects a numpy array of palette indices, and returns an RGBA array of the same shape plus one axis for the channels
+    #index 0 is transparent, and any index past the end of the palette comes out black
+    lookup = np.zeros((256,4), dtype=np.uint8)
+    colors = convert_to_rgb_array(palette)[:256]
+    lookup[:len(colors),:3] = colors
+    lookup[1:,3] = 255
+    return lookup[pixels]
+
+def access_heatmap(stats, zoom=16):
+    #draws the per-bank histograms from an AccessStats (see RomHandler.enable_instrumentation()) as a 16x16 grid with
+    # one cell per SNES bank, bank $00 at the top left and bank $FF at the bottom right.
+    #reads are red and writes are green, on a log scale so that the quiet banks still show up next to the busy ones
+    def scale(byte_counts):
+        levels = np.log1p(np.asarray(byte_counts, dtype=np.float64))
+        if levels.max() == 0:
+            return np.zeros(levels.shape, dtype=np.uint8)
+        return np.round(255*levels/levels.max()).astype(np.uint8)
+
+    pixels = np.zeros((16,16,3), dtype=np.uint8)
+    pixels[...,0] = scale(stats.bank_reads).reshape(16,16)
+    pixels[...,1] = scale(stats.bank_writes).reshape(16,16)
+    image = Image.fromarray(pixels)
+    if zoom != 1:
+        image = image.resize((16*zoom, 16*zoom), Image.NEAREST)
     return image
-            
 
-def convert_tile_from_bitplanes(raw_tile):
-    #an attempt to make this ugly process mildly efficient
-    tile = np.zeros((8,8), dtype=np.uint8)
-
-    tile[:,4] = raw_tile[31:15:-2]
-    tile[:,5] = raw_tile[30:14:-2]
-    tile[:,6] = raw_tile[15::-2]
-    tile[:,7] = raw_tile[14::-2]
-
-    shaped_tile = tile.reshape(8,8,1)
 
-    tile_bits = np.unpackbits(shaped_tile, axis=2)
-    fixed_bits = np.packbits(tile_bits, axis=1)
-    returnvalue = fixed_bits.reshape(8,8)
-    returnvalue = returnvalue.swapaxes(0,1)
-    returnvalue = np.fliplr(returnvalue)
-    return returnvalue
+def convert_tile_from_bitplanes(raw_tile):
+    #single tile version of convert_tiles_from_bitplanes()
+    return convert_tiles_from_bitplanes(raw_tile)[0]
 
 def convert_indexed_tile_to_bitplanes(indexed_tile):
-    #this should literally just be the inverse of convert_tile_from_bitplanes(), and so it was written in this way
-    #indexed_tile = convert_tile_from_bitplanes([i for i in range(0,64,2)])
-    #indexed_tile = convert_tile_from_bitplanes([0x00,0x00,0x00,0x00,0x00,0x00,0x00,0x00,0x00,0x00,0x7E,0x52,0x7E,0x52,0x7E,0x12,0x00,0x00,0x00,0x00,0x00,0x00,0x00,0x00,0x00,0x00,0x2C,0x04,0x2C,0x04,0x7C,0x44])
-    indexed_tile = np.array(indexed_tile,dtype=np.uint8).reshape(8,8)
-    indexed_tile = np.fliplr(indexed_tile)
-    indexed_tile = indexed_tile.swapaxes(0,1)
-    fixed_bits = indexed_tile.reshape(8,1,8)  #in the opposite direction, this had axis=1 collapsed
-    tile_bits = np.unpackbits(fixed_bits,axis=1)
-    shaped_tile = np.packbits(tile_bits,axis=2)
-    tile = shaped_tile.reshape(8,8)
-    low_bitplanes = np.ravel(tile[:,6:8])[::-1]
-    high_bitplanes = np.ravel(tile[:,4:6])[::-1]
-    return np.append(low_bitplanes, high_bitplanes)
-    
+    #this should literally just be the inverse of convert_tile_from_bitplanes()
+    return convert_indexed_tiles_to_bitplanes(indexed_tile)[0]
+
+def convert_tiles_from_bitplanes(raw_tiles, bpp=4):
+    #decodes a whole sheet of SNES tiles at once.
+    #expects the raw tile data for N tiles (as bytes, or as something numpy can turn into an (N, 8*bpp) array of bytes)
+    #returns an (N,8,8) array of palette indices, where the 8x8 part is indexed [x][y], same as convert_tile_from_bitplanes()
+    if bpp not in [2,4,8]:
+        raise NotImplementedError(f"Function convert_tiles_from_bitplanes() called for {bpp}bpp, but this is not implemented.")
+    raw_tiles = _as_byte_array(raw_tiles)
+    if raw_tiles.size % (8*bpp) != 0:
+        raise AssertionError(f"Function convert_tiles_from_bitplanes() called on {raw_tiles.size} bytes, which is not a whole number of {bpp}bpp tiles")
+
+    #the bitplanes are stored in pairs: row by row, one byte of the first plane of the pair and then one byte of the second
+    pairs = raw_tiles.reshape(-1, bpp//2, 8, 2)                     #[tile, pair of planes, row, plane within pair]
+    planes = pairs.transpose(0,1,3,2).reshape(-1, bpp, 8)           #[tile, plane, row]
+    bits = np.unpackbits(planes[..., np.newaxis], axis=-1)         #[tile, plane, row, x]  (most significant bit is leftmost)
+
+    indices = bits[:,0].copy()
+    for plane in range(1,bpp):
+        indices |= bits[:,plane] << plane
+    return indices.swapaxes(1,2)                                    #[tile, x, y]
+
+def convert_indexed_tiles_to_bitplanes(indexed_tiles, bpp=4):
+    #the inverse of convert_tiles_from_bitplanes(): takes (N,8,8) indices laid out [tile][x][y] (or anything that reshapes to that)
+    #and returns an (N, 8*bpp) array with the raw SNES data for each tile
+    if bpp not in [2,4,8]:
+        raise NotImplementedError(f"Function convert_indexed_tiles_to_bitplanes() called for {bpp}bpp, but this is not implemented.")
+    tiles = np.asarray(indexed_tiles, dtype=np.uint8).reshape(-1,8,8).swapaxes(1,2)     #[tile, y, x]
+
+    bits = np.stack([(tiles >> plane) & 1 for plane in range(bpp)], axis=1)            #[tile, plane, row, x]
+    planes = np.packbits(bits, axis=-1)[..., 0]                                       #[tile, plane, row]
+    pairs = planes.reshape(-1, bpp//2, 2, 8).transpose(0,1,3,2)                       #[tile, pair of planes, row, plane within pair]
+    return pairs.reshape(-1, 8*bpp)
+
+def _as_byte_array(data):
+    #raw bytes (e.g. from bulk_read()) are wrapped without copying; anything else goes through numpy
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return np.frombuffer(data, dtype=np.uint8)
+    return np.asarray(data, dtype=np.uint8)
+
+
+#every 555 color converted to (r,g,b) ahead of time, so that conversions are just a lookup
+_555_TO_RGB = np.stack([8*(np.arange(0x8000) & 0b11111),
+                        8*((np.arange(0x8000) >> 5) & 0b11111),
+                        8*((np.arange(0x8000) >> 10) & 0b11111)], axis=1).astype(np.uint8)
 
 def convert_to_rgb(palette):   #expects big endian 2-byte colors in a list, returns (r,g,b) tuples
-    return [single_convert_to_rgb(color) for color in palette]
+    return [tuple(color) for color in convert_to_rgb_array(palette).tolist()]
+
+def convert_to_rgb_array(palette):   #same as convert_to_rgb(), but takes and returns numpy arrays; the result is (N,3)
+    return _555_TO_RGB[np.asarray(palette, dtype=np.int64).reshape(-1) & 0x7FFF]
 
 def single_convert_to_rgb(color):    #from 555
     red = 8*(color & 0b11111)
@@ -158,7 +465,12 @@ def single_convert_to_rgb(color):    #from 555
     return (red,green,blue)
 
 def convert_to_555(palette):   #expects (r,g,b) tuples in a list, returns big endian 2-byte colors in a list
-    return [single_convert_to_555(color) for color in palette]
+    return convert_to_555_array(palette).tolist()
+
+def convert_to_555_array(palette):   #same as convert_to_555(), but takes an (N,3) array (or anything that reshapes to it) and returns a numpy array
+    rgb = np.asarray(palette, dtype=np.int64).reshape(-1,3)
+    red, green, blue = ((rgb % 0xFF) // 8).T
+    return (blue << 10) + (green << 5) + red
 
 def single_convert_to_555(color):  #expects an (r,g,b) tuple, returns a big endian 2-byte value
     red,green,blue = color